@@ -1,28 +1,157 @@
 # agent class for neural network that will learn how to play go by playing against itself
+import multiprocessing as mp
+import os
+import queue
 import random  # for random actions for the agent
+import time
+import numpy as np
+from environment import Position
+from fastboard import FastGoBoard, BLACK, WHITE, INT_TO_COLOR, neighbor_table
+from players import Player
+from scoring import compute_game_result
 
 
 class Agent:
-    def __init__(self):
+    """TD(lambda) self-play agent in the style of TD-Gammon.
+
+    The value of a position is a logistic function of its black and white
+    stone planes and estimates the chance that black wins. Black picks the
+    move with the highest afterstate value and white the lowest, with
+    epsilon-greedy exploration. With a replay.ReplayBuffer every finished
+    game's afterstates are stored in it for replay_update.
+    """
+
+    def __init__(self, size: int = 9, alpha: float = 0.01, lam: float = 0.7, epsilon: float = 0.1, weights=None,
+                 replay=None):
+        self.size = size
+        self.alpha = alpha  # learning rate
+        self.lam = lam  # trace decay, 0 is one-step TD and 1 is Monte Carlo
+        self.epsilon = epsilon
+        self.weights = np.zeros(2 * size * size + 1) if weights is None else weights  # last entry is the bias
         self.episodes = []
-        self.states = {}
+        self.replay = replay
         self.new_episode()
         self.reward = 0
 
     def new_episode(self):
-        self.episodes = []
+        self.episodes = []  # afterstates of the current game
+        self.actions = []  # x * size + y of the move leading to each, size * size for a pass
+        self.hashes = []  # zobrist hash of each
         self.color = random.randint(0, 1)  # randomly choose if playing black or white
         self.score = 0
-        self.opponent = (
-            Agent()
-        )  # for now this is just another agent will probably need to be changed
+        self.opponent = self  # self-play, both colors use the same weights
+
+    def end_episode(self, reward):
+        """Close the game and return its afterstates as a (moves, size*size) array"""
+        self.addReward(reward)
+        trajectory = np.array(self.episodes, dtype=np.int8).reshape(-1, self.size * self.size)
+        if self.replay is not None:
+            self.replay.add_game(trajectory, reward, self.actions, self.value(trajectory), self.hashes)
+        self.episodes = []  # actions and hashes stay until new_episode, the caller may still want them
+        return trajectory
+
+    def addReward(self, new_reward):
+        self.reward += new_reward
+
+    def value(self, stones: np.ndarray) -> np.ndarray:
+        """Estimated chance that black wins for each row of flat stone arrays"""
+        stones = np.atleast_2d(stones)
+        n = self.size * self.size
+        logits = (stones == BLACK) @ self.weights[:n] + (stones == WHITE) @ self.weights[n:2 * n] + self.weights[-1]
+        return 1.0 / (1.0 + np.exp(-logits))
+
+    def select_move(self, board: FastGoBoard, color: str) -> Position:
+        """Pick a move for color and remember the resulting afterstate"""
+        size = self.size
+        stones = board.stones
+        legal = board.legal_moves(color)[:-1]
+        own = BLACK if color == 'b' else WHITE
+        neighbors = neighbor_table(size)
+        candidates = [p for p in np.flatnonzero(legal).tolist()
+                      if not all(stones[q] == own for q in neighbors[p])]  # don't fill own eyes
+        afterstates = []
+        moves = []
+        hashes = []
+        for p in candidates:
+            move = Position(p // size, p % size)
+            if board.push(move, color):  # superko can still reject a move the mask allows
+                afterstates.append(stones.copy())
+                moves.append(move)
+                hashes.append(board.hash)
+                board.pop()
+        if moves and random.random() < self.epsilon:
+            choice = random.randrange(len(moves))
+        else:
+            afterstates.append(stones.copy())  # passing keeps the board as it is
+            moves.append(Position(-1, -1))
+            hashes.append(board.hash)
+            values = self.value(np.array(afterstates))
+            if own == WHITE:
+                values = -values
+            best = np.flatnonzero(values == values.max()).tolist()
+            if len(best) > 1 and best[-1] == len(moves) - 1:
+                best.pop()  # on a tie play a stone rather than pass
+            choice = random.choice(best)
+        self.episodes.append(afterstates[choice])
+        move = moves[choice]
+        self.actions.append(size * size if move.x == -1 else move.x * size + move.y)
+        self.hashes.append(hashes[choice])
+        return move
+
+    def play_game(self, max_moves: int = None):
+        """Play one self-play game, returns its afterstates and 1.0 if black won else 0.0"""
+        self.new_episode()
+        board = FastGoBoard(self.size, superko=True)
+        max_moves = max_moves if max_moves is not None else 2 * self.size * self.size
+        color = BLACK
+        passes = 0
+        for _ in range(max_moves):
+            move = self.select_move(board, INT_TO_COLOR[color])
+            if move.x == -1:
+                passes += 1
+                if passes == 2:
+                    break
+            else:
+                board.place_stone(move, INT_TO_COLOR[color])
+                passes = 0
+            color = 3 - color
+        reward = 1.0 if compute_game_result(board).winner == Player.black else 0.0
+        return self.end_episode(reward), reward
+
+    def td_update(self, trajectory: np.ndarray, reward: float):
+        """Offline TD(lambda) on one game using lambda-returns computed backwards from the result"""
+        if len(trajectory) == 0:
+            return
+        values = self.value(trajectory)
+        returns = np.empty_like(values)
+        target = reward
+        for t in range(len(values) - 1, -1, -1):
+            returns[t] = target
+            target = (1 - self.lam) * values[t] + self.lam * target
+        delta = (returns - values) * values * (1 - values)  # error times the sigmoid gradient
+        n = self.size * self.size
+        self.weights[:n] += self.alpha * (delta @ (trajectory == BLACK))
+        self.weights[n:2 * n] += self.alpha * (delta @ (trajectory == WHITE))
+        self.weights[-1] += self.alpha * delta.sum()
 
-    def end_episode(self):
-        def addReward(self, new_reward):
-            self.reward += new_reward
+    def replay_update(self, replay, batch_size: int = 64, rng: np.random.Generator = None):
+        """One step towards the stored game results on a minibatch drawn from replay,
+        importance-weighted and feeding the errors back as priorities"""
+        if not len(replay):
+            return
+        batch, rows, weights = replay.sample(batch_size, rng)
+        stones = batch['stones']
+        values = self.value(stones)
+        errors = batch['reward'] - values
+        replay.update_priorities(rows, errors)
+        delta = weights * errors * values * (1 - values) / batch_size
+        n = self.size * self.size
+        self.weights[:n] += self.alpha * (delta @ (stones == BLACK))
+        self.weights[n:2 * n] += self.alpha * (delta @ (stones == WHITE))
+        self.weights[-1] += self.alpha * delta.sum()
 
 
-class State:
+class State:  # per-object record, the replay.ReplayBuffer rows hold the same per position
     def __init__(self, score):
         self.score = score
         self.estimate = 0.0
@@ -33,3 +162,77 @@ class State:
             self.action = action
             self.pi = 0.5  # policy
             self.taken = 1
+
+
+def _self_play_worker(size, epsilon, shared_weights, version, trajectories, stop, seed):
+    """Play games with the latest published weights and send every finished game to the learner"""
+    random.seed(seed)
+    agent = Agent(size, epsilon=epsilon)
+    seen_version = -1
+    while not stop.is_set():
+        if version.value != seen_version:
+            with shared_weights.get_lock():
+                agent.weights = np.frombuffer(shared_weights.get_obj()).copy()
+                seen_version = version.value
+        trajectory, reward = agent.play_game()
+        trajectories.put((trajectory, reward, np.array(agent.actions, dtype=np.int16),
+                          np.array(agent.hashes, dtype=np.uint64)))
+
+
+def train(num_games: int, size: int = 9, num_workers: int = None, sync_every: int = 16,
+          alpha: float = 0.01, lam: float = 0.7, epsilon: float = 0.1, agent: Agent = None,
+          replay_batches: int = 1, replay_batch_size: int = 64) -> Agent:
+    """Self-play training: worker processes play games, this process runs the TD(lambda) learner.
+
+    Finished games come back over a queue and the learner publishes its
+    weights to the workers through shared memory every sync_every games.
+    When agent has a replay buffer every game is added to it and followed
+    by replay_batches minibatch updates.
+    """
+    num_workers = num_workers or os.cpu_count()
+    agent = agent or Agent(size, alpha=alpha, lam=lam, epsilon=epsilon)
+    shared_weights = mp.Array('d', len(agent.weights))
+    np.frombuffer(shared_weights.get_obj())[:] = agent.weights
+    version = mp.Value('i', 0)
+    trajectories = mp.Queue()
+    stop = mp.Event()
+    workers = [
+        mp.Process(target=_self_play_worker,
+                   args=(size, epsilon, shared_weights, version, trajectories, stop, random.getrandbits(32)),
+                   daemon=True)
+        for _ in range(num_workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    start = time.perf_counter()
+    black_wins = 0
+    for game in range(1, num_games + 1):
+        trajectory, reward, actions, hashes = trajectories.get()
+        agent.td_update(trajectory, reward)
+        if agent.replay is not None:
+            agent.replay.add_game(trajectory, reward, actions, agent.value(trajectory), hashes)
+            for _ in range(replay_batches):
+                agent.replay_update(agent.replay, replay_batch_size)
+        black_wins += reward
+        if game % sync_every == 0:
+            with shared_weights.get_lock():
+                np.frombuffer(shared_weights.get_obj())[:] = agent.weights
+                version.value += 1
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    while any(worker.is_alive() for worker in workers):
+        try:  # keep draining so workers blocked on put can exit
+            trajectories.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    for worker in workers:
+        worker.join()
+    print(f"{num_games} games in {elapsed:.1f}s ({num_games / elapsed:.1f} games/sec, "
+          f"{num_workers} workers), black won {black_wins / num_games:.0%}")
+    return agent
+
+
+if __name__ == "__main__":
+    train(200, size=9)
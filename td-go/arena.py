@@ -0,0 +1,237 @@
+# headless bot-vs-bot matches across a process pool, with win rates and an Elo estimate
+#
+#   python arena.py '{"kind": "mcts", "time_budget": 0.1}' '{"kind": "random"}' --games 200 --size 9
+#   python arena.py '{"kind": "mcts", "evaluate": "char_model"}' '{"kind": "char_model"}' --size 9
+#
+# A player is a JSON config, see make_bot for the kinds. Every worker
+# builds both bots once, games alternate colors and every result is
+# appended to the JSONL file as soon as it comes back.
+import argparse
+import json
+import math
+import multiprocessing as mp
+import os
+import random
+import time
+import numpy as np
+from environment import Position
+from fastboard import FastGoBoard, COLOR_TO_INT, neighbor_table
+from scoring import compute_game_result
+
+PASS = Position(-1, -1)
+
+
+class RandomBot:
+    """Uniformly random legal move that doesn't fill its own eye, a pass when there is none"""
+
+    def __init__(self, seed: int = None):
+        self.rng = random.Random(seed)
+
+    def move(self, history, board: FastGoBoard, color: str) -> Position:
+        size = board.size
+        own = COLOR_TO_INT[color]
+        neighbors = neighbor_table(size)
+        stones = board.stones
+        candidates = [p for p in np.flatnonzero(board.legal_moves(color)[:-1]).tolist()
+                      if not all(stones[q] == own for q in neighbors[p])]
+        if not candidates:
+            return PASS
+        p = self.rng.choice(candidates)
+        return Position(p // size, p % size)
+
+
+class CharModelBot:
+    """The character LSTM through playGame's legality-masked move scores"""
+
+    def __init__(self, model_path: str = None, vocab_path: str = None):
+        import playGame
+        if model_path:
+            playGame.MODEL_FILE_NAME = model_path
+        if vocab_path:
+            playGame.VOCAB_FILE_NAME = vocab_path
+        self.game = playGame.Game()
+        self.best_legal_move = playGame.best_legal_move
+
+    def move(self, history, board: FastGoBoard, color: str) -> Position:
+        prev_move = history[-1] if history else PASS
+        scores = self.game.move_scores(prev_move, color, board.size)
+        return self.best_legal_move(scores, board.legal_moves(color), board.size)
+
+
+class MoveModelBot:
+    """move_model's move-token LSTM, masked to legal moves, may pass"""
+
+    def __init__(self, size: int, model_path: str = None):
+        import move_model
+        from playGame import best_legal_move
+        self.predictor = move_model.load_predictor(size, model_path or move_model.MOVE_MODEL_FILE_NAME)
+        self.best_legal_move = best_legal_move
+
+    def move(self, history, board: FastGoBoard, color: str) -> Position:
+        return self.best_legal_move(self.predictor.probabilities(history), board.legal_moves(color), board.size)
+
+
+class MCTSBot:
+    """mcts.MCTSPlayer for each color, so one bot can take either side"""
+
+    def __init__(self, size: int, **options):
+        from mcts import MCTSPlayer
+        from players import Player
+        self.players = {c: MCTSPlayer(Player.black if c == 'b' else Player.white, size=size, **options)
+                        for c in ('b', 'w')}
+
+    def move(self, history, board: FastGoBoard, color: str) -> Position:
+        return self.players[color].select_move(history, board.size)
+
+
+def make_bot(config: dict, size: int, seed: int = None):
+    """Build a bot from a config: {"kind": "random" | "char_model" | "move_model" | "mcts", ...options}"""
+    options = dict(config)
+    kind = options.pop('kind')
+    options.pop('name', None)
+    if kind == 'random':
+        return RandomBot(seed)
+    if kind == 'char_model':
+        return CharModelBot(**options)
+    if kind == 'move_model':
+        return MoveModelBot(size, **options)
+    if kind == 'mcts':
+        options.setdefault('processes', 1)  # the pool already fills the cores, its daemonic workers can't start more
+        if options.get('evaluate') == 'char_model':  # saved_model.h5 priors instead of uniform ones
+            from mcts import CharModelEvaluator
+            options['evaluate'] = CharModelEvaluator(seed)
+        return MCTSBot(size, **options)
+    raise ValueError(f"Unknown bot kind {kind!r}")
+
+
+def play_headless(black, white, size: int, max_moves: int = None):
+    """One game without any printing or input, returns (GameResults, moves played)"""
+    board = FastGoBoard(size, superko=True)
+    max_moves = max_moves if max_moves is not None else 2 * size * size
+    history = []
+    passes = 0
+    color = 'b'
+    while passes < 2 and len(history) < max_moves:
+        bot = black if color == 'b' else white
+        move = bot.move(history, board, color)
+        if (move.x == -1 and move.y == -1) or not board.place_stone(move, color):
+            move = PASS  # a rejected move forfeits the turn
+            passes += 1
+        else:
+            passes = 0
+        history.append(move)
+        color = 'w' if color == 'b' else 'b'
+    return compute_game_result(board), len(history)
+
+
+_bots = None
+
+
+def _init_worker(config_a: dict, config_b: dict, size: int, seed: int):
+    global _bots
+    seed = seed + os.getpid()
+    _bots = (make_bot(config_a, size, seed), make_bot(config_b, size, seed + 1))
+
+
+def _play_one(task):
+    game, a_is_black, size, max_moves = task
+    bot_a, bot_b = _bots
+    black, white = (bot_a, bot_b) if a_is_black else (bot_b, bot_a)
+    start = time.perf_counter()
+    result, moves = play_headless(black, white, size, max_moves)
+    margin = result.b - result.w - result.komi
+    a_won = (margin > 0) == a_is_black
+    return {
+        'game': game,
+        'a_color': 'b' if a_is_black else 'w',
+        'winner': 'a' if a_won else 'b',
+        'margin': margin,  # b - (w + komi)
+        'a_margin': margin if a_is_black else -margin,
+        'result': str(result),
+        'moves': moves,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def elo(score: float, games: int, z: float = 1.96):
+    """Elo difference for a score fraction and its z-sigma interval, from the Wilson interval
+    on the score, which stays a real range at 0 and 1 where the normal approximation collapses"""
+    def to_elo(p):
+        p = min(max(p, 0.5 / games), 1 - 0.5 / games)  # a clean sweep would be infinite
+        return -400 * math.log10(1 / p - 1)
+    spread = z * z / games
+    center = (score + spread / 2) / (1 + spread)
+    error = z / (1 + spread) * math.sqrt(score * (1 - score) / games + spread / (4 * games))
+    return to_elo(score), to_elo(center - error), to_elo(center + error)
+
+
+def summarize(results) -> dict:
+    """Win rates, margins and Elo of player a against player b"""
+    games = len(results)
+    if not games:
+        return {'games': 0}
+    a_wins = sum(r['winner'] == 'a' for r in results)
+    a_black = [r for r in results if r['a_color'] == 'b']
+    a_white = [r for r in results if r['a_color'] == 'w']
+    score = a_wins / games
+    rating, low, high = elo(score, games)
+    return {
+        'games': games,
+        'a_wins': a_wins,
+        'b_wins': games - a_wins,
+        'a_win_rate': score,
+        'a_win_rate_as_black': sum(r['winner'] == 'a' for r in a_black) / len(a_black) if a_black else None,
+        'a_win_rate_as_white': sum(r['winner'] == 'a' for r in a_white) / len(a_white) if a_white else None,
+        'black_win_rate': sum(r['margin'] > 0 for r in results) / games,
+        'a_mean_margin': float(np.mean([r['a_margin'] for r in results])),
+        'elo': rating,
+        'elo_95': [low, high],
+        'mean_moves': float(np.mean([r['moves'] for r in results])),
+    }
+
+
+def run_match(config_a: dict, config_b: dict, games: int, size: int = 9, workers: int = None,
+              out: str = None, max_moves: int = None, seed: int = 0) -> dict:
+    """Play games between a and b on a process pool, alternating who takes black"""
+    workers = workers or os.cpu_count()
+    tasks = [(game, game % 2 == 0, size, max_moves) for game in range(games)]
+    results = []
+    start = time.perf_counter()
+    out_file = open(out, 'a', encoding='utf-8') if out else None
+    try:
+        with mp.Pool(workers, initializer=_init_worker, initargs=(config_a, config_b, size, seed)) as pool:
+            for result in pool.imap_unordered(_play_one, tasks):
+                results.append(result)
+                if out_file:
+                    out_file.write(json.dumps(result) + '\n')
+                    out_file.flush()
+    finally:
+        if out_file:
+            out_file.close()
+    summary = summarize(results)
+    summary['seconds'] = time.perf_counter() - start
+    summary['games_per_second'] = games / summary['seconds']
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless bot-vs-bot match")
+    parser.add_argument('a', help="JSON config of player a, or a file holding one")
+    parser.add_argument('b', help="JSON config of player b, or a file holding one")
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--size', type=int, default=9)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-moves', type=int, default=None)
+    parser.add_argument('--out', default='arena_results.jsonl')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    def load(config):
+        if os.path.exists(config):
+            with open(config, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        return json.loads(config)
+
+    summary = run_match(load(args.a), load(args.b), args.games, args.size, args.workers, args.out,
+                        args.max_moves, args.seed)
+    print(json.dumps(summary, indent=2))
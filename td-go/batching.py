@@ -0,0 +1,133 @@
+# coalesces prediction requests from many concurrent games into one batched forward pass
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class InferenceBatcher:
+    """Thread-backed batching front end for a decoder with decode_batch(prompts, steps)
+    and score_pairs_batch(prompts, lead, first, second, max_lead).
+
+    Callers from any thread use decode() and score_pairs() (or their _async
+    versions from asyncio), which have the same signatures as
+    LSTMBeamDecoder's, so a batcher can be passed anywhere a decoder is
+    expected. A worker thread waits for the first request, keeps collecting
+    until max_batch_size requests are queued or max_wait seconds have
+    passed, runs one batched call per distinct set of arguments and hands
+    every caller its own result.
+    """
+
+    def __init__(self, decoder, max_batch_size: int = 32, max_wait: float = 0.005):
+        self.decoder = decoder
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._requests = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()  # nothing gets queued behind close()'s end marker
+        self.batches = 0
+        self.requests = 0
+        self.max_batch = 0
+        self.last_batch_size = 0
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def _submit(self, key, prompt) -> Future:
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("InferenceBatcher is closed")
+            self._requests.put((key, prompt, future))
+        return future
+
+    def submit(self, prompt, steps: int) -> Future:
+        return self._submit(('decode', steps), prompt)
+
+    def submit_pairs(self, prompt, lead: int, first, second, max_lead: int = 4) -> Future:
+        return self._submit(('pairs', lead, tuple(first), tuple(second), max_lead), prompt)
+
+    def decode(self, prompt, steps: int):
+        return self.submit(prompt, steps).result()
+
+    async def decode_async(self, prompt, steps: int):
+        return await asyncio.wrap_future(self.submit(prompt, steps))
+
+    def score_pairs(self, prompt, lead: int, first, second, max_lead: int = 4):
+        return self.submit_pairs(prompt, lead, first, second, max_lead).result()
+
+    async def score_pairs_async(self, prompt, lead: int, first, second, max_lead: int = 4):
+        return await asyncio.wrap_future(self.submit_pairs(prompt, lead, first, second, max_lead))
+
+    @property
+    def queue_depth(self) -> int:
+        """Requests waiting for the next batch"""
+        return self._requests.qsize()
+
+    def stats(self) -> dict:
+        return {
+            'queue_depth': self.queue_depth,
+            'batches': self.batches,
+            'requests': self.requests,
+            'mean_batch_size': self.requests / self.batches if self.batches else 0.0,
+            'max_batch_size': self.max_batch,
+            'last_batch_size': self.last_batch_size,
+        }
+
+    def close(self):
+        """Finish the queued requests and stop the worker thread"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._requests.put(None)
+        self._worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._requests.get(timeout=remaining) if remaining > 0 else self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:  # close() was called, put the marker back for _run
+                self._requests.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._requests.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            self.batches += 1
+            self.requests += len(batch)
+            self.last_batch_size = len(batch)
+            self.max_batch = max(self.max_batch, len(batch))
+            by_key = {}
+            for item in batch:
+                by_key.setdefault(item[0], []).append(item)
+            for key, items in by_key.items():
+                prompts = [prompt for _, prompt, _ in items]
+                try:
+                    if key[0] == 'decode':
+                        results = self.decoder.decode_batch(prompts, key[1])
+                    else:
+                        _, lead, first, second, max_lead = key
+                        results = self.decoder.score_pairs_batch(prompts, lead, first, second, max_lead)
+                except Exception as error:
+                    for _, _, future in items:
+                        future.set_exception(error)
+                    continue
+                for (_, _, future), result in zip(items, results):
+                    future.set_result(result)
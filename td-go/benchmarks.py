@@ -0,0 +1,266 @@
+# performance benchmarks for the board engines, scoring and bot inference
+#
+#   python benchmarks.py                       # run, write benchmark_results.json, compare to the baseline
+#   python benchmarks.py --dir /tmp/go-bench   # keep the results and baseline somewhere else
+#   python benchmarks.py --save-baseline       # run and store the results as the new baseline
+#   python benchmarks.py --quick --skip-model  # fewer games, no TensorFlow
+#
+# Exits with status 1 when any benchmark is more than --threshold (default 20%)
+# worse than the baseline. Baselines are machine specific, record one per machine,
+# so both files live outside the repo, in GO_BENCHMARK_DIR or ~/.cache/td-go by default.
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import numpy as np
+from environment import GoBoard, Position
+from fastboard import FastGoBoard
+from scoring import compute_game_result, compute_game_results
+
+RESULTS_FILE_NAME = 'benchmark_results.json'
+BASELINE_FILE_NAME = 'benchmark_baseline.json'
+BENCHMARK_DIR = os.environ.get('GO_BENCHMARK_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'td-go'))
+THRESHOLD = 0.2
+SIZES = (9, 13, 19)
+
+
+def _result(value: float, unit: str, higher_is_better: bool, **extra) -> dict:
+    return dict(value=value, unit=unit, higher_is_better=higher_is_better, **extra)
+
+
+def _random_moves(size: int, seed: int):
+    rng = random.Random(seed)
+    return [Position(rng.randrange(size), rng.randrange(size)) for _ in range(size * size * 3)]
+
+
+def _play_random(board, moves):
+    """Alternately try the moves in order, returns the number that were legal"""
+    played = 0
+    color = 'b'
+    for move in moves:
+        if board.place_stone(move, color):
+            played += 1
+            color = 'w' if color == 'b' else 'b'
+    return played
+
+
+def bench_place_stone(engine, size: int, games: int, repeat: int) -> dict:
+    """Legal moves per second of random games, the best of repeat runs over the same games"""
+    move_lists = [_random_moves(size, seed) for seed in range(games)]
+    best = 0.0
+    for _ in range(repeat):
+        played = 0
+        start = time.perf_counter()
+        for moves in move_lists:
+            played += _play_random(engine(size), moves)
+        best = max(best, played / (time.perf_counter() - start))
+    return _result(best, 'moves/s', True)
+
+
+def _filled_boards(size: int, count: int):
+    boards = []
+    for seed in range(count):
+        board = FastGoBoard(size)
+        _play_random(board, _random_moves(size, seed))
+        boards.append(board)
+    return boards
+
+
+def bench_scoring(size: int, boards: int, repeat: int) -> dict:
+    """compute_game_result milliseconds per board on boards filled by random play"""
+    filled = _filled_boards(size, boards)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for board in filled:
+            compute_game_result(board)
+        best = min(best, (time.perf_counter() - start) / len(filled))
+    return _result(best * 1000, 'ms/board', False)
+
+
+def bench_scoring_batch(size: int, boards: int, repeat: int) -> dict:
+    filled = _filled_boards(size, boards)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        compute_game_results(filled)
+        best = min(best, (time.perf_counter() - start) / len(filled))
+    return _result(best * 1000, 'ms/board', False)
+
+
+def bench_vecenv_games(size: int, num_envs: int, games: int) -> dict:
+    """Complete random-move games per second in a VecGoEnv, scoring included, no bot involved"""
+    from vecenv import VecGoEnv
+    env = VecGoEnv(num_envs, size)
+    env.reset()
+    rng = np.random.default_rng(0)
+    start = time.perf_counter()
+    while env.games_played < games:
+        legal = env.legal_moves()
+        legal[:, -1] = False  # passing only once nothing else is legal keeps games full length
+        scores = np.where(legal, rng.random(legal.shape), -1.0)
+        actions = np.where(legal.any(axis=1), scores.argmax(axis=1), size * size)
+        env.step(actions)
+    return _result(env.games_played / (time.perf_counter() - start), 'games/s', True)
+
+
+def bench_headless_games(size: int, games: int, black: dict, white: dict, max_moves: int = None) -> dict:
+    """Complete bot-vs-bot games per second through arena's headless loop, the same games a match plays"""
+    from arena import make_bot, play_headless
+    bots = (make_bot(black, size, 0), make_bot(white, size, 1))
+    moves = 0
+    start = time.perf_counter()
+    for game in range(games):
+        _, played = play_headless(*(bots if game % 2 == 0 else bots[::-1]), size, max_moves)
+        moves += played
+    elapsed = time.perf_counter() - start
+    return _result(games / elapsed, 'games/s', True, moves_per_second=moves / elapsed)
+
+
+def _have_vocabulary() -> bool:
+    """Whether playGame can get its vocabulary, saved or built from the corpus, without failing"""
+    import playGame
+    return os.path.exists(playGame.VOCAB_FILE_NAME) or os.path.exists(playGame.INPUT_FILE_NAME)
+
+
+def bench_move_scores(moves: int, batch: int) -> dict:
+    """Per-move latency of the bot's move scoring and of ai_predict's beam decode, and batched
+    throughput of the decoder behind them"""
+    import playGame
+    from batching import InferenceBatcher
+    from concurrent.futures import ThreadPoolExecutor
+    results = {}
+    decoder = playGame.get_decoder()
+    rng = np.random.default_rng(0)
+    prompts = [rng.integers(0, decoder.vocab_size, size=6) for _ in range(moves)]
+    tokens = list(range(min(19, decoder.vocab_size)))
+    lead = decoder.vocab_size - 1
+    decoder.score_pairs(prompts[0], lead, tokens, tokens, playGame.NEXT_COORDINATES)  # warm-up
+    if _have_vocabulary():
+        game = playGame.Game()
+        replies = [Position(x % 19, (x * 7) % 19) for x in range(moves)]
+        start = time.perf_counter()
+        for move in replies:
+            game.move_scores(move, 'b', 19)
+        results['move_scores_latency'] = _result((time.perf_counter() - start) / moves * 1000, 'ms/move', False)
+        start = time.perf_counter()
+        for move in replies:
+            playGame.ai_predict(game.input_to_move(move, 'b'))
+        results['ai_predict_latency'] = _result((time.perf_counter() - start) / moves * 1000, 'ms/move', False)
+    start = time.perf_counter()
+    for prompt in prompts:
+        decoder.decode(prompt, playGame.NEXT_COORDINATES)
+    elapsed = time.perf_counter() - start
+    results['decode_latency'] = _result(elapsed / moves * 1000, 'ms/move', False)
+    results['decode_beam_throughput'] = _result(moves * decoder.beam_size * playGame.NEXT_COORDINATES / elapsed,
+                                                'beam steps/s', True)
+    start = time.perf_counter()
+    for prompt in prompts:
+        decoder.score_pairs(prompt, lead, tokens, tokens, playGame.NEXT_COORDINATES)
+    elapsed = time.perf_counter() - start
+    results['score_pairs_latency'] = _result(elapsed / moves * 1000, 'ms/move', False)
+    results['score_pairs_throughput'] = _result(moves / elapsed, 'moves/s', True)
+    # games asking from their own threads, coalesced by the batcher the way shared bots are
+    with InferenceBatcher(decoder, max_batch_size=batch) as batcher, ThreadPoolExecutor(batch) as pool:
+        start = time.perf_counter()
+        list(pool.map(lambda prompt: batcher.score_pairs(prompt, lead, tokens, tokens, playGame.NEXT_COORDINATES),
+                      prompts))
+        elapsed = time.perf_counter() - start
+        mean_batch = batcher.stats()['mean_batch_size']
+    results['batched_score_pairs_throughput'] = _result(moves / elapsed, 'moves/s', True, batch=batch,
+                                                        mean_batch=mean_batch)
+    return results
+
+
+def run(quick: bool = False, skip_model: bool = False) -> dict:
+    games, repeat, boards = (3, 1, 20) if quick else (10, 3, 100)
+    results = {}
+    for size in SIZES:
+        results[f'goboard_place_stone_{size}'] = bench_place_stone(GoBoard, size, games, repeat)
+        results[f'fastboard_place_stone_{size}'] = bench_place_stone(FastGoBoard, size, games, repeat)
+        results[f'compute_game_result_{size}'] = bench_scoring(size, boards, repeat)
+        results[f'compute_game_results_{size}'] = bench_scoring_batch(size, boards, repeat)
+    results['vecenv_random_games_9'] = bench_vecenv_games(9, 16, 32 if quick else 128)
+    results['headless_random_bot_games_9'] = bench_headless_games(9, 4 if quick else 20, {'kind': 'random'},
+                                                                  {'kind': 'random'})
+    if not skip_model:
+        if _have_vocabulary():
+            results['headless_char_model_games_9'] = bench_headless_games(
+                9, 2 if quick else 6, {'kind': 'char_model'}, {'kind': 'random'}, max_moves=120)
+        else:
+            print("no vocab.json or corpus, skipping headless_char_model_games_9")
+        results.update(bench_move_scores(20 if quick else 100, 16))
+    return {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'quick': quick,
+        },
+        'results': results,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float = THRESHOLD):
+    """Benchmarks in both runs as (name, baseline, current, change, regressed), change > 0 is better"""
+    rows = []
+    for name, current in results['results'].items():
+        base = baseline['results'].get(name)
+        if base is None or not base['value']:
+            continue
+        change = current['value'] / base['value'] - 1
+        if not current['higher_is_better']:
+            change = base['value'] / current['value'] - 1
+        rows.append((name, base['value'], current['value'], change, change < -threshold))
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the board engines, scoring and bot inference")
+    parser.add_argument('--dir', default=BENCHMARK_DIR, help="where --out and --baseline go unless given as paths")
+    parser.add_argument('--out', default=RESULTS_FILE_NAME)
+    parser.add_argument('--baseline', default=BASELINE_FILE_NAME)
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help="fail when a benchmark is this fraction worse than the baseline")
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--quick', action='store_true')
+    parser.add_argument('--skip-model', action='store_true', help="don't load the model or import TensorFlow")
+    args = parser.parse_args(argv)
+    args.out = os.path.join(args.dir, args.out)  # an absolute --out or --baseline wins over --dir
+    args.baseline = os.path.join(args.dir, args.baseline)
+    os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+    os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+
+    results = run(args.quick, args.skip_model)
+    for name, result in results['results'].items():
+        print(f"{name:32s} {result['value']:14.3f} {result['unit']}")
+    with open(args.out, 'w') as file:
+        json.dump(results, file, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}, run with --save-baseline to record one")
+        return 0
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    regressions = 0
+    print()
+    for name, base, current, change, regressed in compare(results, baseline, args.threshold):
+        regressions += regressed
+        print(f"{name:32s} {change:+8.1%}{'  REGRESSION' if regressed else ''}")
+    if regressions:
+        print(f"{regressions} benchmark(s) regressed more than {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
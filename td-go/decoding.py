@@ -0,0 +1,244 @@
+# beam search for the character LSTM that carries the LSTM states forward
+# instead of re-running the model over the whole sequence for every new character
+import time
+import numpy as np
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+_ACTIVATIONS = {'tanh': np.tanh, 'sigmoid': _sigmoid}
+
+
+def _activation(name):
+    if name not in _ACTIVATIONS:
+        raise ValueError(f"Unsupported LSTM activation {name!r}")
+    return _ACTIVATIONS[name]
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, ties going to the lower index"""
+    k = min(k, scores.size)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    threshold = scores[candidates].min()
+    above = np.flatnonzero(scores > threshold)
+    tied = np.flatnonzero(scores == threshold)[:k - len(above)]
+    chosen = np.concatenate([above, tied])
+    return chosen[np.lexsort((chosen, -scores[chosen]))]
+
+
+class LSTMBeamDecoder:
+    """NumPy re-implementation of the saved stacked LSTM -> softmax model, one token at a time.
+
+    Works for one-hot character input and for an Embedding first layer,
+    like move_model's move-token model.
+
+    Beams are int index arrays and each step only feeds the newest token
+    through the LSTM states of the beam it extends. The surviving beams
+    are picked from the flattened beam x vocab scores with argpartition.
+    """
+
+    def __init__(self, model, beam_size: int = 8):
+        self.beam_size = beam_size
+        self.lstms = []
+        embedding = None
+        for layer in model.layers:
+            kind = type(layer).__name__
+            weights = [w.astype(np.float32) for w in layer.get_weights()]
+            config = layer.get_config()
+            if kind == 'Embedding':
+                embedding = weights[0]
+            elif kind == 'LSTM':
+                kernel, recurrent = weights[0], weights[1]
+                if embedding is not None and not self.lstms:
+                    kernel = embedding @ kernel  # token rows of the first kernel, same lookup as one-hot input
+                bias = weights[2] if len(weights) > 2 else np.zeros(kernel.shape[1], dtype=np.float32)
+                self.lstms.append((kernel, recurrent, bias,
+                                   _activation(config['activation']),
+                                   _activation(config['recurrent_activation'])))
+            elif kind == 'Dense':
+                self.dense_kernel, self.dense_bias = weights
+            elif kind not in ('InputLayer', 'Dropout'):
+                raise ValueError(f"Unsupported layer {kind} in decoder model")
+        self.vocab_size = self.dense_kernel.shape[1]
+        self.moves = 0
+        self.total_time = 0.0
+        self.last_latency = 0.0
+
+    @property
+    def mean_latency(self) -> float:
+        return self.total_time / self.moves if self.moves else 0.0
+
+    def initial_states(self, batch: int = 1):
+        return [(np.zeros((batch, recurrent.shape[0]), dtype=np.float32),
+                 np.zeros((batch, recurrent.shape[0]), dtype=np.float32))
+                for _, recurrent, _, _, _ in self.lstms]
+
+    def step(self, tokens: np.ndarray, states):
+        """Advance every row of states by one token, the one-hot input becomes a kernel row lookup"""
+        new_states = []
+        x = None
+        for i, (kernel, recurrent, bias, activation, recurrent_activation) in enumerate(self.lstms):
+            h, c = states[i]
+            z = (kernel[tokens] if i == 0 else x @ kernel) + h @ recurrent + bias
+            gate_i, gate_f, gate_c, gate_o = np.split(z, 4, axis=1)
+            c = recurrent_activation(gate_f) * c + recurrent_activation(gate_i) * activation(gate_c)
+            h = recurrent_activation(gate_o) * activation(c)
+            new_states.append((h, c))
+            x = h
+        return new_states
+
+    def probabilities(self, states) -> np.ndarray:
+        logits = states[-1][0] @ self.dense_kernel + self.dense_bias
+        logits -= logits.max(axis=1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def decode(self, prompt, steps: int):
+        """Beam search steps tokens past prompt, returns [(log probability, token indices)] best first.
+
+        The token indices include the prompt, matching the text the old
+        full-sequence beam search built up.
+        """
+        return self.decode_batch([prompt], steps)[0]
+
+    def _step_rows(self, rows: np.ndarray, tokens: np.ndarray, states):
+        """Advance only the given rows of states, in place, the other rows keep their states"""
+        if len(rows) == len(states[0][0]):
+            return self.step(tokens, states)
+        stepped = self.step(tokens, [(h[rows], c[rows]) for h, c in states])
+        for (h, c), (new_h, new_c) in zip(states, stepped):
+            h[rows] = new_h
+            c[rows] = new_c
+        return states
+
+    def _run_prompts(self, prompts):
+        """States after each prompt, one row per prompt"""
+        lengths = np.array([len(prompt) for prompt in prompts])
+        states = self.initial_states(len(prompts))
+        for t in range(lengths.max(initial=0)):
+            rows = np.flatnonzero(lengths > t)  # prompts of different lengths share the steps they have
+            states = self._step_rows(rows, np.array([prompts[r][t] for r in rows]), states)
+        return states
+
+    def decode_batch(self, prompts, steps: int):
+        """decode for several prompts at once, every LSTM step runs over all their beams together"""
+        start = time.perf_counter()
+        prompts = [np.asarray(prompt, dtype=np.int64) for prompt in prompts]
+        num = len(prompts)
+        states = self._run_prompts(prompts)
+
+        scores = np.zeros((num, 1))
+        sequences = [prompt[np.newaxis, :] for prompt in prompts]
+        for i in range(steps):
+            beams = scores.shape[1]
+            log_probs = np.log(self.probabilities(states)).reshape(num, beams, self.vocab_size)
+            total = (scores[:, :, np.newaxis] + log_probs).reshape(num, beams * self.vocab_size)
+            chosen = np.stack([top_k(row, self.beam_size) for row in total])
+            beam_index, tokens = np.divmod(chosen, self.vocab_size)
+            scores = np.take_along_axis(total, chosen, axis=1)
+            sequences = [np.concatenate([sequence[index], new[:, np.newaxis]], axis=1)
+                         for sequence, index, new in zip(sequences, beam_index, tokens)]
+            if i < steps - 1:
+                rows = (np.arange(num)[:, np.newaxis] * beams + beam_index).ravel()
+                states = self.step(tokens.ravel(), [(h[rows], c[rows]) for h, c in states])
+        self.last_latency = time.perf_counter() - start
+        self.moves += num
+        self.total_time += self.last_latency * num
+        return [list(zip(row.tolist(), sequence)) for row, sequence in zip(scores, sequences)]
+
+    def score_pairs(self, prompt, lead: int, first, second, max_lead: int = 4) -> np.ndarray:
+        """Log probabilities of every (first[i], second[j]) token pair that follows lead after prompt.
+
+        Decodes greedily from prompt until the model emits lead, forcing it
+        after max_lead tokens, then scores all first tokens at once and all
+        second tokens after each of them: one batched step, so the cost is
+        bounded however unlikely the best allowed pair is. Callers rank or
+        mask the (len(first), len(second)) result themselves.
+        """
+        return self.score_pairs_batch([prompt], lead, first, second, max_lead)[0]
+
+    def score_pairs_batch(self, prompts, lead: int, first, second, max_lead: int = 4):
+        """score_pairs for several prompts at once, every LSTM step runs over all of them together"""
+        start = time.perf_counter()
+        prompts = [np.asarray(prompt, dtype=np.int64) for prompt in prompts]
+        first = np.asarray(first, dtype=np.int64)
+        second = np.asarray(second, dtype=np.int64)
+        num = len(prompts)
+        states = self._run_prompts(prompts)
+        rows = np.arange(num)  # still decoding towards lead
+        for i in range(max_lead):
+            if i == max_lead - 1:
+                tokens = np.full(len(rows), lead)
+            else:
+                probabilities = self.probabilities([(h[rows], c[rows]) for h, c in states])
+                tokens = np.argmax(probabilities, axis=1)
+            states = self._step_rows(rows, tokens, states)
+            rows = rows[tokens != lead]
+            if not len(rows):
+                break
+        first_log_probs = np.log(self.probabilities(states)[:, first])
+        repeated = np.repeat(np.arange(num), len(first))
+        states = self.step(np.tile(first, num), [(h[repeated], c[repeated]) for h, c in states])
+        second_log_probs = np.log(self.probabilities(states)[:, second]).reshape(num, len(first), len(second))
+        self.last_latency = time.perf_counter() - start
+        self.moves += num
+        self.total_time += self.last_latency * num
+        return list(first_log_probs[:, :, np.newaxis] + second_log_probs)
+
+
+def reference_beam_search(model, prompt, steps: int, beam_size: int = 8):
+    """The original ai_predict search: full-sequence predict per step, one-hot inputs, argmax-and-zero top-k"""
+    encoding_width = model.output_shape[-1]
+    one_hots = []
+    for index in prompt:
+        x = np.zeros(encoding_width)
+        x[index] = 1
+        one_hots.append(x)
+    beams = [(np.log(1.0), list(prompt), one_hots)]
+    for i in range(steps):
+        minibatch = np.array([triple[2] for triple in beams])
+        y_predict = model.predict(minibatch, verbose=0)
+        new_beams = []
+        for j, softmax_vec in enumerate(y_predict):
+            triple = beams[j]
+            for k in range(beam_size):
+                char_index = np.argmax(softmax_vec)
+                new_prob = triple[0] + np.log(softmax_vec[char_index])
+                x = np.zeros(encoding_width)
+                x[char_index] = 1
+                new_one_hots = triple[2].copy()
+                new_one_hots.append(x)
+                new_beams.append((new_prob, triple[1] + [int(char_index)], new_one_hots))
+                softmax_vec[char_index] = 0
+        new_beams.sort(key=lambda tup: tup[0], reverse=True)
+        beams = new_beams[0:beam_size]
+    return [(float(prob), np.array(tokens)) for prob, tokens, _ in beams]
+
+
+def check_parity(model, prompts, steps: int = 4, beam_size: int = 8):
+    """Compare the incremental decoder with reference_beam_search, prints max score gap and latencies"""
+    decoder = LSTMBeamDecoder(model, beam_size)
+    same = True
+    max_gap = 0.0
+    reference_time = 0.0
+    for prompt in prompts:
+        start = time.perf_counter()
+        expected = reference_beam_search(model, prompt, steps, beam_size)
+        reference_time += time.perf_counter() - start
+        beams = decoder.decode(prompt, steps)
+        same &= all(np.array_equal(a[1], b[1]) for a, b in zip(expected, beams))
+        max_gap = max(max_gap, max(abs(a[0] - b[0]) for a, b in zip(expected, beams)))
+    print(f"identical beams: {same}, max log-prob gap {max_gap:.2e}")
+    print(f"per move: reference {reference_time / len(prompts) * 1000:.1f} ms, "
+          f"incremental {decoder.mean_latency * 1000:.2f} ms")
+    return same
+
+
+if __name__ == "__main__":
+    from playGame import get_model
+    model = get_model()
+    rng = np.random.default_rng(0)
+    vocab_size = model.output_shape[-1]
+    check_parity(model, [rng.integers(0, vocab_size, size=rng.integers(5, 40)) for _ in range(20)])
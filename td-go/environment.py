@@ -4,8 +4,11 @@
 # from agent import Agent
 from collections import namedtuple
 from typing import List, Optional, Set, Dict
+import numpy as np
 from players import Player, Point
 from scoring import compute_game_result
+from instrumentation import stats
+from territory import TerritoryTracker
 
 BOARDSIZE = 19
 Position = namedtuple("Position", ["x", "y"])
@@ -70,6 +73,8 @@ class GoBoard:
         self.groups = []
         self.previous_state = None  # For ko rule
         self._grid = {}
+        self.encoder = None  # features.FeatureEncoder kept current by every move, see its attach
+        self.territory = None  # territory.TerritoryTracker kept current by every move, see track_territory
 
     def get_color(self, point: Position) -> Optional[str]:
         if not (0 <= point.x < self.size and 0 <= point.y < self.size):
@@ -104,6 +109,10 @@ class GoBoard:
 
     def place_stone(self, position: Position, color: str) -> bool:
         """Place a stone and handle all Go rules, including captures and ko"""
+        if position.x == -1 and position.y == -1:
+            if self.encoder is not None:
+                self.encoder.record_pass(color)
+            return False  # a pass, callers handle it themselves; never touch board[-1][-1]
         if not self.is_valid_position(position) or self.get_stone(position) is not None:
             return False
 
@@ -138,9 +147,18 @@ class GoBoard:
                 self._remove_group(new_group)
                 self.board[position.x][position.y] = None
                 self._grid.pop(position, None)
+                removed = [stone.position.x * self.size + stone.position.y for stone in new_group.stones]
+                if self.territory is not None:
+                    self.territory.update((p, 0) for p in removed)
+                if self.encoder is not None:
+                    self.encoder.refresh(self, removed)
                 return False
 
         # Perform captures
+        captured_points = [stone.position.x * self.size + stone.position.y
+                           for group in captured_groups for stone in group.stones]
+        if stats.enabled and captured_groups:
+            stats.count('captures', sum(len(group.stones) for group in captured_groups))
         for group in captured_groups:
             self._remove_group(group)
 
@@ -149,6 +167,12 @@ class GoBoard:
             self._remove_group(new_group)
             self.board[position.x][position.y] = None
             self._grid.pop(position, None)
+            # friendly stones merged into new_group went with it
+            removed = [stone.position.x * self.size + stone.position.y for stone in new_group.stones]
+            if self.territory is not None:
+                self.territory.update((p, 0) for p in removed)
+            if self.encoder is not None:
+                self.encoder.refresh(self, removed)
             return False
 
         # Update previous state for ko
@@ -157,8 +181,80 @@ class GoBoard:
         else:
             self.previous_state = None
 
+        if self.territory is not None:
+            self.territory.update([(position.x * self.size + position.y, 1 if color == 'b' else 2)]
+                                  + [(p, 0) for p in captured_points])
+        if self.encoder is not None:
+            self.encoder.on_move(self, position.x * self.size + position.y, color,
+                                 [position.x * self.size + position.y] + captured_points)
         return True
 
+    def track_territory(self):
+        """Keep a running territory count from now on, so current_score doesn't rescore the board"""
+        if self.territory is None:
+            TerritoryTracker(self).attach(self)
+        return self.territory
+
+    def current_score(self):
+        """Score of the position as it stands, always what compute_game_result would return for it"""
+        if self.territory is None:
+            return compute_game_result(self)
+        return self.territory.score()
+
+    def decisive(self, margin: float) -> Optional[Player]:
+        """The player ahead by at least margin points after komi, None while the game is closer"""
+        score = self.current_score()
+        lead = score.b - score.w - score.komi
+        if lead >= margin:
+            return Player.black
+        if -lead >= margin:
+            return Player.white
+        return None
+
+    def legal_moves(self, color: str) -> np.ndarray:
+        """Boolean mask of size*size + 1 entries, index x * size + y then pass, of the moves
+        place_stone would accept, worked out without touching the board"""
+        legal = np.zeros(self.size * self.size + 1, dtype=bool)
+        legal[-1] = True
+        liberties = {}
+        for x in range(self.size):
+            for y in range(self.size):
+                if self.board[x][y] is not None:
+                    continue
+                position = Position(x, y)
+                groups = self._get_adjacent_groups(position)
+                for group in groups:
+                    if group not in liberties:
+                        group.calculate_liberties(self)
+                        liberties[group] = len(group.liberties)
+                captured = [group for group in groups if group.color != color and liberties[group] == 1]
+                if len(captured) == 1 and len(captured[0].stones) == 1:
+                    captured_pos = next(iter(captured[0].stones)).position
+                    if self.previous_state and self.previous_state == (captured_pos, color):
+                        continue  # ko, same check as place_stone
+                has_room = (any(0 <= x + dx < self.size and 0 <= y + dy < self.size
+                                and self.board[x + dx][y + dy] is None
+                                for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)])
+                            or any(group.color == color and liberties[group] > 1 for group in groups))
+                legal[x * self.size + y] = bool(captured) or has_room
+        return legal
+
+    def groups_touching(self, points):
+        """(stone indices, liberty count) of every group on or next to one of the flat indices in points"""
+        groups = set()
+        for p in points:
+            position = Position(p // self.size, p % self.size)
+            stone = self.board[position.x][position.y]
+            if stone is not None and stone.group is not None:
+                groups.add(stone.group)
+            groups.update(self._get_adjacent_groups(position))
+        result = []
+        for group in groups:
+            group.calculate_liberties(self)
+            result.append(([stone.position.x * self.size + stone.position.y for stone in group.stones],
+                           len(group.liberties)))
+        return result
+
     def _get_adjacent_groups(self, position: Position) -> List[StoneGroup]:
         """Get all unique groups adjacent to a position"""
         groups = set()
@@ -0,0 +1,461 @@
+# array-backed go board engine for self-play and search
+# stones live in one flat buffer indexed x * size + y, groups are union-find trees
+# and every group root keeps its set of liberties up to date as stones come and go
+import random
+from typing import List, Optional
+import numpy as np
+from environment import BOARDSIZE, GoBoard, Position, Stone
+from players import Player, Point
+from instrumentation import stats
+from scoring import compute_game_result
+
+EMPTY = 0
+BLACK = 1  # same values as Player.black / Player.white
+WHITE = 2
+COLOR_TO_INT = {'b': BLACK, 'w': WHITE}
+INT_TO_COLOR = {BLACK: 'b', WHITE: 'w'}
+INT_TO_PLAYER = {BLACK: Player.black, WHITE: Player.white}
+
+_neighbor_tables = {}
+_zobrist_tables = {}
+
+
+def neighbor_table(size: int):
+    """Orthogonal neighbors of every flat index, built once per board size"""
+    table = _neighbor_tables.get(size)
+    if table is None:
+        table = []
+        for x in range(size):
+            for y in range(size):
+                neighbors = []
+                if x > 0:
+                    neighbors.append((x - 1) * size + y)
+                if x < size - 1:
+                    neighbors.append((x + 1) * size + y)
+                if y > 0:
+                    neighbors.append(x * size + y - 1)
+                if y < size - 1:
+                    neighbors.append(x * size + y + 1)
+                table.append(tuple(neighbors))
+        table = tuple(table)
+        _neighbor_tables[size] = table
+    return table
+
+
+def zobrist_table(size: int):
+    """Random 64-bit key per (color, point), seeded by size so hashes match across processes"""
+    table = _zobrist_tables.get(size)
+    if table is None:
+        rng = random.Random(size)
+        n = size * size
+        table = (
+            (0,) * n,
+            tuple(rng.getrandbits(64) for _ in range(n)),
+            tuple(rng.getrandbits(64) for _ in range(n)),
+        )
+        _zobrist_tables[size] = table
+    return table
+
+
+class FastGoBoard:
+    """Drop-in replacement for environment.GoBoard backed by flat arrays.
+
+    Same place_stone/get_stone/get API, so playGame.Game and
+    scoring.compute_game_result work with either engine. With superko=True
+    a move that recreates any earlier position is rejected. buffer lets the
+    stones live in caller-owned memory, e.g. one row of a stacked array.
+    """
+
+    def __init__(self, size: int = BOARDSIZE, superko: bool = False, buffer=None):
+        self.winner = None
+        self.size = size
+        self.num_rows = size
+        self.num_cols = size
+        n = size * size
+        self._neighbors = neighbor_table(size)
+        if buffer is None:
+            self._stones = bytearray(n)
+        else:
+            self._stones = memoryview(buffer).cast('B')
+            self._stones[:] = bytes(n)
+        self.stones = np.frombuffer(self._stones, dtype=np.int8)  # zero-copy view of the board
+        self._parent = list(range(n))  # union-find parent, roots point to themselves
+        self._next = list(range(n))  # circular linked list of the stones in each group
+        self._group_size = [1] * n  # only meaningful at roots
+        self._liberties = [None] * n  # set of empty points, only kept at roots
+        self.ko_point = None  # flat index the player in ko_color may not play next
+        self.ko_color = EMPTY
+        self._zobrist = zobrist_table(size)
+        self.hash = 0  # zobrist hash of the stones on the board, empty board is 0
+        self.superko = superko
+        self.history = {self.hash} if superko else None  # hashes of every position so far
+        self._undo = []  # one entry per push, see pop
+        self._legal = np.ones((3, n + 1), dtype=bool)  # legal_moves mask per color, last entry is pass
+        self._legal_dirty = set()  # points moved on or captured since the mask was last refreshed
+        self.encoder = None  # features.FeatureEncoder kept current by every move, see its attach
+        self.territory = None  # territory.TerritoryTracker kept current by every move, see track_territory
+
+    def _find(self, p: int) -> int:
+        # no path compression so unions can be undone, union by size keeps trees shallow
+        parent = self._parent
+        while parent[p] != p:
+            p = parent[p]
+        return p
+
+    def _union(self, a: int, b: int, log: Optional[list] = None) -> int:
+        """Merge the groups rooted at a and b, returns the new root"""
+        if self._group_size[a] < self._group_size[b]:
+            a, b = b, a
+        self._parent[b] = a
+        self._group_size[a] += self._group_size[b]
+        libs_a, libs_b = self._liberties[a], self._liberties[b]
+        swapped = len(libs_a) < len(libs_b)
+        if swapped:
+            libs_a, libs_b = libs_b, libs_a
+        if log is not None:
+            log.append((a, b, swapped, libs_b, libs_b - libs_a))
+        libs_a |= libs_b
+        self._liberties[a] = libs_a
+        self._liberties[b] = None
+        # splice the two circular stone lists together
+        self._next[a], self._next[b] = self._next[b], self._next[a]
+        return a
+
+    def _undo_union(self, a: int, b: int, swapped: bool, small: set, added: set):
+        self._next[a], self._next[b] = self._next[b], self._next[a]
+        large = self._liberties[a]
+        large -= added
+        if swapped:
+            self._liberties[a], self._liberties[b] = small, large
+        else:
+            self._liberties[b] = small
+        self._group_size[a] -= self._group_size[b]
+        self._parent[b] = b
+
+    def _group_points(self, root: int) -> List[int]:
+        points = [root]
+        p = self._next[root]
+        while p != root:
+            points.append(p)
+            p = self._next[p]
+        return points
+
+    def _remove_group(self, root: int, log: Optional[list] = None) -> List[int]:
+        """Take a captured group off the board and give its points back as liberties"""
+        points = self._group_points(root)
+        stones = self._stones
+        if log is not None:
+            log.append((
+                root,
+                stones[root],
+                points,
+                [self._parent[p] for p in points],
+                [self._next[p] for p in points],
+                [self._group_size[p] for p in points],
+            ))
+        for p in points:
+            stones[p] = EMPTY
+            self._parent[p] = p
+            self._next[p] = p
+            self._group_size[p] = 1
+            self._liberties[p] = None
+        for p in points:
+            for q in self._neighbors[p]:
+                if stones[q]:
+                    self._liberties[self._find(q)].add(p)
+        return points
+
+    def _restore_group(self, move: int, root: int, color: int, points, parents, nexts, sizes):
+        """Put a captured group back exactly as it was, its only liberty being the capturing move"""
+        stones = self._stones
+        for p, parent, nxt, size in zip(points, parents, nexts, sizes):
+            stones[p] = color
+            self._parent[p] = parent
+            self._next[p] = nxt
+            self._group_size[p] = size
+        self._liberties[root] = {move}
+        for p in points:
+            for q in self._neighbors[p]:
+                if stones[q] and stones[q] != color:
+                    self._liberties[self._find(q)].discard(p)
+
+    def _play(self, p: int, c: int, log: Optional[list] = None) -> bool:
+        stones = self._stones
+        if stones[p] or (p == self.ko_point and c == self.ko_color):
+            return False
+        find = self._find
+        liberties = self._liberties
+        own_roots = []
+        opp_roots = []
+        new_libs = set()
+        for q in self._neighbors[p]:
+            s = stones[q]
+            if s == EMPTY:
+                new_libs.add(q)
+                continue
+            r = find(q)
+            if s == c:
+                if r not in own_roots:
+                    own_roots.append(r)
+            elif r not in opp_roots:
+                opp_roots.append(r)
+        captured_roots = [r for r in opp_roots if len(liberties[r]) == 1]
+        if not new_libs and not captured_roots:
+            # suicide unless a friendly group still has another liberty
+            if all(len(liberties[r]) == 1 for r in own_roots):
+                return False
+
+        zobrist = self._zobrist
+        new_hash = self.hash ^ zobrist[c][p]
+        opp_keys = zobrist[3 - c]
+        for r in captured_roots:
+            for q in self._group_points(r):
+                new_hash ^= opp_keys[q]
+        if self.superko:
+            if new_hash in self.history:
+                return False
+            self.history.add(new_hash)
+
+        unions = captures = None
+        if log is not None:
+            unions = []
+            captures = []
+            log.append((p, self.hash, self.ko_point, self.ko_color, opp_roots, bool(own_roots), unions, captures))
+        self.hash = new_hash
+
+        stones[p] = c
+        for r in opp_roots:
+            liberties[r].discard(p)
+        liberties[p] = new_libs
+        root = p
+        for r in own_roots:
+            root = self._union(root, r, unions)
+        liberties[root].discard(p)
+
+        captured = []
+        for r in captured_roots:
+            captured += self._remove_group(r, captures)
+        if stats.enabled and captured:
+            stats.count('captures', len(captured))
+
+        dirty = self._legal_dirty
+        dirty.add(p)
+        dirty.update(captured)
+        if self.ko_point is not None:
+            dirty.add(self.ko_point)
+        if len(captured) == 1 and self._group_size[root] == 1 and len(liberties[root]) == 1:
+            self.ko_point = captured[0]
+            self.ko_color = 3 - c
+        else:
+            self.ko_point = None
+            self.ko_color = EMPTY
+        if self.territory is not None:
+            self.territory.update([(p, c)] + [(q, EMPTY) for q in captured])
+        if self.encoder is not None:
+            self.encoder.on_move(self, p, INT_TO_COLOR[c], [p] + captured)
+        return True
+
+    def place_stone(self, position: Position, color: str) -> bool:
+        """Place a stone and handle all Go rules, including captures and ko"""
+        if position.x == -1 and position.y == -1:
+            if self.encoder is not None:
+                self.encoder.record_pass(color)
+            return False  # a pass places nothing, same as GoBoard
+        if not (0 <= position.x < self.size and 0 <= position.y < self.size):
+            return False
+        return self._play(position.x * self.size + position.y, COLOR_TO_INT[color])
+
+    def push(self, position: Position, color: str) -> bool:
+        """Play a move that pop() can take back, a pass is always legal here"""
+        if position.x == -1 and position.y == -1:
+            self._undo.append((None, self.hash, self.ko_point, self.ko_color, None, False, None, None))
+            if self.encoder is not None:
+                self.encoder.on_move(self, None, color, ())
+            return True
+        if not (0 <= position.x < self.size and 0 <= position.y < self.size):
+            return False
+        return self._play(position.x * self.size + position.y, COLOR_TO_INT[color], self._undo)
+
+    def pop(self):
+        """Take back the last pushed move"""
+        p, prev_hash, ko_point, ko_color, opp_roots, merged, unions, captures = self._undo.pop()
+        for point in (self.ko_point, ko_point):
+            if point is not None:
+                self._legal_dirty.add(point)
+        self.ko_point = ko_point
+        self.ko_color = ko_color
+        if p is None:
+            if self.encoder is not None:
+                self.encoder.on_undo(self, ())
+            return
+        self._legal_dirty.add(p)
+        for capture in captures:
+            self._legal_dirty.update(capture[2])
+        if self.superko:
+            self.history.discard(self.hash)
+        self.hash = prev_hash
+        for capture in reversed(captures):
+            self._restore_group(p, *capture)
+        if merged:
+            self._liberties[self._find(p)].add(p)
+        for union in reversed(unions):
+            self._undo_union(*union)
+        self._stones[p] = EMPTY
+        self._liberties[p] = None
+        for r in opp_roots:
+            self._liberties[r].add(p)
+        if self.territory is not None:
+            self.territory.update([(p, EMPTY)] + [(q, capture[1]) for capture in captures for q in capture[2]])
+        if self.encoder is not None:
+            self.encoder.on_undo(self, [p] + [q for capture in captures for q in capture[2]])
+
+    def _is_legal(self, p: int, c: int) -> bool:
+        """Occupancy, ko and suicide check for one point, superko is left to place_stone/push"""
+        stones = self._stones
+        if stones[p] or (p == self.ko_point and c == self.ko_color):
+            return False
+        for q in self._neighbors[p]:
+            s = stones[q]
+            if s == EMPTY:
+                return True
+            libs = len(self._liberties[self._find(q)])
+            if (libs > 1) if s == c else (libs == 1):
+                return True  # connects to a group with room to spare, or captures
+        return False
+
+    def legal_moves(self, color: str) -> np.ndarray:
+        """Boolean mask of size*size + 1 entries, index x * size + y then pass.
+
+        Only points around moves and captures since the last call are
+        re-examined: the points themselves, their neighbors and the
+        liberties of the groups next to them. The returned array is the
+        board's own cache, so copy it before writing to it.
+        """
+        if self._legal_dirty:
+            stones = self._stones
+            neighbors = self._neighbors
+            touched = set()
+            for p in self._legal_dirty:
+                touched.add(p)
+                for q in (p,) + neighbors[p]:
+                    if stones[q]:
+                        touched |= self._liberties[self._find(q)]
+                    else:
+                        touched.add(q)
+            legal = self._legal
+            for p in touched:
+                legal[BLACK, p] = self._is_legal(p, BLACK)
+                legal[WHITE, p] = self._is_legal(p, WHITE)
+            self._legal_dirty.clear()
+        return self._legal[COLOR_TO_INT[color]]
+
+    def groups_touching(self, points):
+        """(stone indices, liberty count) of every group on or next to one of points"""
+        stones = self._stones
+        roots = set()
+        for p in points:
+            for q in (p,) + self._neighbors[p]:
+                if stones[q]:
+                    roots.add(self._find(q))
+        return [(self._group_points(r), len(self._liberties[r])) for r in roots]
+
+    def count_liberties(self, position: Position) -> int:
+        """Number of liberties of the group at position, 0 for an empty point"""
+        p = position.x * self.size + position.y
+        if not self._stones[p]:
+            return 0
+        return len(self._liberties[self._find(p)])
+
+    def get_color(self, point: Position) -> Optional[str]:
+        if not (0 <= point.x < self.size and 0 <= point.y < self.size):
+            return None
+        return INT_TO_COLOR.get(self._stones[point.x * self.size + point.y])
+
+    def is_on_grid(self, point: Point) -> bool:
+        return 1 <= point.row < self.size and 1 <= point.col < self.size
+
+    def get(self, point: Point) -> Optional[Player]:
+        if not self.is_on_grid(point):
+            return None
+        s = self._stones[(point.row - 1) * self.size + point.col - 1]  # Convert to 0-based
+        return INT_TO_PLAYER[s] if s else None
+
+    def is_valid_position(self, position: Position) -> bool:
+        if position.x == -1 and position.y == -1:
+            return True
+        return 0 <= position.x < self.size and 0 <= position.y < self.size
+
+    def get_stone(self, position: Position) -> Optional[Stone]:
+        color = self.get_color(position)
+        return Stone(color, position) if color else None
+
+    # the same running count as GoBoard, pushes and pops keep it current too
+    track_territory = GoBoard.track_territory
+    current_score = GoBoard.current_score
+    decisive = GoBoard.decisive
+
+    def display(self):
+        """Print a simple ASCII representation of the board"""
+        for y in range(self.size):
+            row = []
+            for x in range(self.size):
+                s = self._stones[x * self.size + y]
+                row.append(INT_TO_COLOR[s] if s else ".")
+            print(" ".join(row))
+
+
+def _board_state(board: FastGoBoard):
+    """Everything push/pop has to restore, liberty sets are compared at group roots"""
+    return (
+        bytes(board._stones),
+        tuple(board._parent),
+        tuple(board._next),
+        tuple(board._group_size[p] for p in range(len(board._parent)) if board._parent[p] == p),
+        tuple(frozenset(libs) if libs is not None else None for libs in board._liberties),
+        board.hash,
+        board.ko_point,
+        board.ko_color,
+        frozenset(board.history) if board.history is not None else None,
+    )
+
+
+def check_push_pop(size: int = 9, num_games: int = 20, seed: int = 0) -> bool:
+    """Play random games with push, pop them back to the start and compare every board state"""
+    rng = random.Random(seed)
+    for game in range(num_games):
+        board = FastGoBoard(size, superko=game % 2 == 1)
+        states = [_board_state(board)]
+        color = 'b'
+        passes = 0
+        while passes < 2 and len(states) < size * size * 3:
+            if rng.random() < 0.02:
+                move = Position(-1, -1)
+            else:
+                move = Position(rng.randrange(size), rng.randrange(size))
+            if board.push(move, color):
+                passes = passes + 1 if move.x == -1 else 0
+                states.append(_board_state(board))
+                color = 'w' if color == 'b' else 'b'
+        while len(states) > 1:
+            states.pop()
+            board.pop()
+            if _board_state(board) != states[-1]:
+                return False
+    return True
+
+
+if __name__ == "__main__":
+    print("push/pop replay check passed:", check_push_pop())
+
+    # same capture example as environment.py
+    board = FastGoBoard(5)
+    for x, y in [(0, 0), (1, 0), (1, 1), (0, 2), (1, 3), (0, 4)]:
+        board.place_stone(Position(x, y), "b")
+    for x, y in [(2, 1), (4, 1), (1, 2), (2, 2), (3, 2), (2, 3), (1, 4), (2, 4), (3, 4)]:
+        board.place_stone(Position(x, y), "w")
+    board.place_stone(Position(3, 1), "b")
+    board.place_stone(Position(3, 0), "w")
+    board.place_stone(Position(2, 0), "w")
+    board.place_stone(Position(0, 1), "w")
+    board.display()
+    print(compute_game_result(board))
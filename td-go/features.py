@@ -0,0 +1,181 @@
+# input planes for board-aware models, kept up to date by the board as moves are played
+#
+#   batch = feature_batch(len(boards), 9)
+#   for i, board in enumerate(boards):
+#       FeatureEncoder(9, out=batch[i]).attach(board)
+#   ...play moves on the boards...
+#   model.predict(batch)   # already current, nothing is encoded here
+import numpy as np
+from environment import Position
+
+HISTORY = 8  # previous moves with a plane each
+BLACK_PLANE = 0
+WHITE_PLANE = 1
+TO_PLAY_PLANE = 2  # all ones when black is to move
+LIBERTY_PLANES = 3  # 1, 2, 3 and 4+ liberties of the stone's group
+KO_PLANE = 7  # the point the side to move may not retake
+HISTORY_PLANES = 8  # HISTORY_PLANES + k is the move k + 1 moves ago, empty for passes
+
+
+def num_planes(history: int = HISTORY) -> int:
+    return HISTORY_PLANES + history
+
+
+def feature_batch(batch: int, size: int, history: int = HISTORY) -> np.ndarray:
+    """Zeroed (batch, planes, size, size) float32 buffer, give each encoder one row as out"""
+    return np.zeros((batch, num_planes(history), size, size), dtype=np.float32)
+
+
+class FeatureEncoder:
+    """Feature planes of one board, updated from the points each move changed.
+
+    Attached boards call on_move after every move they accept and on_undo
+    after every pop, with the points whose stones changed. Only those
+    points, the groups on or next to them and one point per history plane
+    are rewritten, so a move costs in proportion to what it changed
+    rather than the board size. planes is the buffer itself, or
+    the caller's out buffer, never a copy.
+    """
+
+    def __init__(self, size: int, history: int = HISTORY, out: np.ndarray = None):
+        self.size = size
+        self.history = history
+        shape = (num_planes(history), size, size)
+        if out is None:
+            out = np.zeros(shape, dtype=np.float32)
+        elif out.shape != shape:
+            raise ValueError(f"out has shape {out.shape}, the encoder needs {shape}")
+        self.planes = out
+        self._flat = out.reshape(len(out), size * size)  # a view as long as out is contiguous
+        if not np.shares_memory(self._flat, out):
+            raise ValueError("out must be C-contiguous")
+        self.moves = []  # (flat index or None for a pass, color) of every move
+        self._shown = [None] * history  # point set on each history plane
+        self._ko = None
+
+    def attach(self, board, to_play: str = 'b'):
+        """Make board keep these planes current from now on, to_play is the color to move next"""
+        board.encoder = self
+        self.sync(board, to_play)
+        return self
+
+    def sync(self, board, to_play: str = 'b'):
+        """Rebuild every plane from the board, for boards set up without an encoder attached"""
+        n = self.size * self.size
+        self.planes[:] = 0
+        self.moves = []
+        self._shown = [None] * self.history
+        self._ko = None
+        self._update_points(board, range(n))
+        self._update_ko(board)
+        self._flat[TO_PLAY_PLANE] = 1.0 if to_play == 'b' else 0.0
+
+    def _update_points(self, board, points):
+        flat = self._flat
+        size = self.size
+        for p in points:
+            color = board.get_color(Position(p // size, p % size))
+            flat[BLACK_PLANE, p] = color == 'b'
+            flat[WHITE_PLANE, p] = color == 'w'
+            flat[LIBERTY_PLANES:LIBERTY_PLANES + 4, p] = 0.0
+        for group, liberties in board.groups_touching(points):
+            plane = LIBERTY_PLANES + min(liberties, 4) - 1
+            flat[LIBERTY_PLANES:LIBERTY_PLANES + 4, group] = 0.0
+            flat[plane, group] = 1.0
+
+    def _update_ko(self, board):
+        if self._ko is not None:
+            self._flat[KO_PLANE, self._ko] = 0.0
+        self._ko = getattr(board, 'ko_point', None)  # GoBoard's ko check never fires, no plane for it
+        if self._ko is not None:
+            self._flat[KO_PLANE, self._ko] = 1.0
+
+    def _update_history(self):
+        """Point each history plane at its move again, only the planes whose move changed are touched"""
+        flat = self._flat
+        moves = self.moves
+        for k in range(self.history):
+            move = moves[-1 - k][0] if k < len(moves) else None
+            shown = self._shown[k]
+            if shown != move:
+                if shown is not None:
+                    flat[HISTORY_PLANES + k, shown] = 0.0
+                if move is not None:
+                    flat[HISTORY_PLANES + k, move] = 1.0
+                self._shown[k] = move
+
+    def on_move(self, board, move, color: str, changed):
+        """After color played move (flat index or None for a pass), changed lists the points
+        whose stones changed: the move and anything it captured"""
+        self.moves.append((move, color))
+        self._update_history()
+        if changed:
+            self._update_points(board, changed)
+        self._update_ko(board)
+        self._flat[TO_PLAY_PLANE] = 1.0 if color == 'w' else 0.0
+
+    def on_undo(self, board, changed):
+        """After the last move was taken back, changed as for on_move"""
+        _, color = self.moves.pop()
+        self._update_history()
+        if changed:
+            self._update_points(board, changed)
+        self._update_ko(board)
+        self._flat[TO_PLAY_PLANE] = 1.0 if color == 'b' else 0.0
+
+    def refresh(self, board, points):
+        """Rewrite the stone and liberty planes around points without recording a move"""
+        self._update_points(board, points)
+        self._update_ko(board)
+
+    def record_pass(self, color: str):
+        """A pass by color, place_stone reports it here since it places nothing"""
+        self.moves.append((None, color))
+        self._update_history()
+        self._flat[TO_PLAY_PLANE] = 1.0 if color == 'w' else 0.0
+
+
+if __name__ == "__main__":
+    import random
+    import time
+    from environment import GoBoard
+    from fastboard import FastGoBoard
+    rng = random.Random(0)
+    # incremental planes against a full re-encode after every move, passes going through
+    # place_stone the way playGame sends them
+    board = GoBoard(5)
+    encoder = FeatureEncoder(5).attach(board)
+    fresh = FeatureEncoder(5)
+    stone_planes = [BLACK_PLANE, WHITE_PLANE] + list(range(LIBERTY_PLANES, LIBERTY_PLANES + 4))
+    color = 'b'
+    last = None
+    for i in range(500):
+        move = Position(-1, -1) if i % 7 == 0 else Position(rng.randrange(5), rng.randrange(5))
+        if board.place_stone(move, color) or move.x == -1:
+            color = 'w' if color == 'b' else 'b'
+            last = None if move.x == -1 else move.x * 5 + move.y
+        fresh.sync(board, color)
+        assert np.array_equal(encoder.planes[stone_planes + [TO_PLAY_PLANE]],
+                              fresh.planes[stone_planes + [TO_PLAY_PLANE]]), (i, move)
+        assert encoder.moves[-1][0] == last and encoder._flat[HISTORY_PLANES].sum() == (last is not None), (i, move)
+    # attached mid-game with white to move
+    assert FeatureEncoder(5).attach(board, 'w').planes[TO_PLAY_PLANE].sum() == 0
+
+    size = 19
+    batch = feature_batch(1, size)
+    board = FastGoBoard(size)
+    encoder = FeatureEncoder(size, out=batch[0]).attach(board)
+    moves = [Position(rng.randrange(size), rng.randrange(size)) for _ in range(2000)]
+    color = 'b'
+    played = 0
+    start = time.perf_counter()
+    for move in moves:
+        if board.place_stone(move, color):
+            played += 1
+            color = 'w' if color == 'b' else 'b'
+    elapsed = time.perf_counter() - start
+    fresh = FeatureEncoder(size)
+    start = time.perf_counter()
+    fresh.sync(board)
+    print(f"{played} moves with planes kept current: {elapsed / played * 1e6:.1f} us/move, "
+          f"full re-encode {(time.perf_counter() - start) * 1e6:.0f} us")
@@ -0,0 +1,195 @@
+# compact columnar store for game records parsed from SGF files
+#
+#   python game_store.py games_dir corpus/*.sgf --workers 8
+#
+# games_dir/moves.bin   int16 point index x * size + y of every move, size * size for a pass
+# games_dir/colors.bin  int8 color of every move, 1 black 2 white
+# games_dir/offsets.npy int64 start of each game in moves.bin, plus the total at the end
+# games_dir/games.npy   one metadata row per game, see GAME_DTYPE
+import argparse
+import math
+import multiprocessing as mp
+import os
+import re
+from collections import namedtuple
+import numpy as np
+from environment import Position
+from fastboard import FastGoBoard, INT_TO_COLOR
+
+MOVE_DTYPE = np.int16
+COLOR_DTYPE = np.int8
+GAME_DTYPE = np.dtype([
+    ('size', np.int16),
+    ('komi', np.float32),
+    ('winner', np.int8),  # 1 black, 2 white, 0 draw or unknown
+    ('margin', np.float32),  # nan for resignations, time-outs and unknown results
+    ('setup', np.int16),  # leading AB/AW handicap stones in the move columns
+])
+
+GameRecord = namedtuple('GameRecord', 'size komi winner margin setup moves colors')
+
+_sgf_token = re.compile(r'\(|\)|;|([A-Za-z]+)\s*((?:\[(?:\\.|[^\\\]])*\]\s*)+)', re.S)
+_sgf_value = re.compile(r'\[((?:\\.|[^\\\]])*)\]', re.S)
+
+
+def _game_trees(text: str):
+    """Main line of every game tree in the text, as a list of nodes (dict of property -> values)"""
+    games = []
+    stack = []  # [nodes, children] for every open '('
+    for match in _sgf_token.finditer(text):
+        token = match.group()
+        if token == '(':
+            stack.append([[], []])
+        elif token == ')':
+            if not stack:
+                continue
+            tree = stack.pop()
+            (stack[-1][1] if stack else games).append(tree)
+        elif token == ';':
+            if stack:
+                stack[-1][0].append({})
+        elif stack and stack[-1][0]:
+            values = [value.replace('\\]', ']') for value in _sgf_value.findall(match.group(2))]
+            stack[-1][0][-1].setdefault(match.group(1).upper(), []).extend(values)
+    main_lines = []
+    for tree in games:
+        nodes = list(tree[0])
+        while tree[1]:
+            tree = tree[1][0]  # first variation is the main line
+            nodes += tree[0]
+        main_lines.append(nodes)
+    return main_lines
+
+
+def _point(value: str, size: int) -> int:
+    if len(value) < 2:
+        return size * size
+    x, y = ord(value[0]) - 97, ord(value[1]) - 97
+    if 0 <= x < size and 0 <= y < size:
+        return x * size + y
+    return size * size  # 'tt' and other off-board values are passes
+
+
+def _result(value: str):
+    value = value.strip().upper()
+    if value in ('0', 'DRAW', 'JIGO'):
+        return 0, 0.0
+    if len(value) >= 2 and value[0] in 'BW' and value[1] == '+':
+        winner = 1 if value[0] == 'B' else 2
+        try:
+            return winner, float(value[2:])
+        except ValueError:
+            return winner, math.nan
+    return 0, math.nan
+
+
+def parse_sgf(text: str):
+    """Parse every game in an SGF text, returns (moves, colors, game rows) as arrays"""
+    moves, colors, rows = [], [], []
+    for nodes in _game_trees(text):
+        if not nodes:
+            continue
+        root = nodes[0]
+        size = int(root.get('SZ', ['19'])[0].split(':')[0] or 19)
+        try:
+            komi = float(root.get('KM', ['nan'])[0])
+        except ValueError:
+            komi = math.nan
+        winner, margin = _result(root.get('RE', [''])[0])
+        game_moves, game_colors = [], []
+        for prop, color in (('AB', 1), ('AW', 2)):
+            for value in root.get(prop, []):
+                game_moves.append(_point(value, size))
+                game_colors.append(color)
+        setup = len(game_moves)
+        for node in nodes:
+            for prop, color in (('B', 1), ('W', 2)):
+                for value in node.get(prop, []):
+                    game_moves.append(_point(value, size))
+                    game_colors.append(color)
+        moves.append(np.array(game_moves, dtype=MOVE_DTYPE))
+        colors.append(np.array(game_colors, dtype=COLOR_DTYPE))
+        rows.append((size, komi, winner, margin, setup))
+    return moves, colors, np.array(rows, dtype=GAME_DTYPE)
+
+
+def _parse_file(path: str):
+    with open(path, 'r', encoding='utf-8', errors='replace') as file:
+        return parse_sgf(file.read())
+
+
+def ingest(paths, out_dir: str, workers: int = None) -> int:
+    """Parse SGF files in a process pool and append them, in order, to a new store in out_dir"""
+    os.makedirs(out_dir, exist_ok=True)
+    offsets = [0]
+    rows = []
+    with open(os.path.join(out_dir, 'moves.bin'), 'wb') as moves_file, \
+            open(os.path.join(out_dir, 'colors.bin'), 'wb') as colors_file, \
+            mp.Pool(workers) as pool:
+        for moves, colors, games in pool.imap(_parse_file, paths, chunksize=4):
+            for game_moves, game_colors in zip(moves, colors):
+                game_moves.tofile(moves_file)
+                game_colors.tofile(colors_file)
+                offsets.append(offsets[-1] + len(game_moves))
+            rows.append(games)
+    np.save(os.path.join(out_dir, 'offsets.npy'), np.array(offsets, dtype=np.int64))
+    games = np.concatenate(rows) if rows else np.zeros(0, dtype=GAME_DTYPE)
+    np.save(os.path.join(out_dir, 'games.npy'), games)
+    return len(games)
+
+
+class GameStore:
+    """Read-only, memory-mapped view of a store written by ingest"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+        self.games = np.load(os.path.join(path, 'games.npy'))
+        if self.offsets[-1]:
+            self.moves = np.memmap(os.path.join(path, 'moves.bin'), dtype=MOVE_DTYPE, mode='r')
+            self.colors = np.memmap(os.path.join(path, 'colors.bin'), dtype=COLOR_DTYPE, mode='r')
+        else:  # np.memmap can't map an empty file
+            self.moves = np.zeros(0, dtype=MOVE_DTYPE)
+            self.colors = np.zeros(0, dtype=COLOR_DTYPE)
+
+    def __len__(self):
+        return len(self.games)
+
+    @property
+    def num_moves(self) -> int:
+        return int(self.offsets[-1])
+
+    def game(self, index: int) -> GameRecord:
+        """Metadata plus zero-copy move and color views of one game"""
+        start, end = self.offsets[index], self.offsets[index + 1]
+        row = self.games[index]
+        return GameRecord(int(row['size']), float(row['komi']), int(row['winner']), float(row['margin']),
+                          int(row['setup']), self.moves[start:end], self.colors[start:end])
+
+    def sample_positions(self, count: int, rng: np.random.Generator = None):
+        """Uniform random positions as (game index, move number) arrays, the position being
+        the board before that move is played"""
+        rng = rng or np.random.default_rng()
+        move_index = rng.integers(0, self.num_moves, size=count)
+        game_index = np.searchsorted(self.offsets, move_index, side='right') - 1
+        return game_index, move_index - self.offsets[game_index]
+
+    def replay(self, index: int, upto: int = None) -> FastGoBoard:
+        """Board after the first upto moves of a game (all of them by default)"""
+        record = self.game(index)
+        board = FastGoBoard(record.size)
+        size = record.size
+        for point, color in zip(record.moves[:upto].tolist(), record.colors[:upto].tolist()):
+            if point != size * size:
+                board.place_stone(Position(point // size, point % size), INT_TO_COLOR[color])
+        return board
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest SGF files into a binary game store")
+    parser.add_argument('out_dir')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    count = ingest(args.files, args.out_dir, args.workers)
+    print(f"{count} games written to {args.out_dir}")
@@ -0,0 +1,138 @@
+# opt-in timers and counters for the game loop, the boards, scoring and the bot
+#
+#   import instrumentation
+#   instrumentation.enable(log_interval=30)   # structured log line every 30 s
+#   Game().play_game(player1, player2)
+#   instrumentation.snapshot()               # {'counters': {...}, 'timers': {...}}
+#
+# Disabled (the default), every hook is one attribute check.
+import cProfile
+import io
+import json
+import logging
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ('stats', 'name', 'start')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Stats:
+    """Named counters and phase timers (calls, total and max seconds), safe to share between threads"""
+
+    def __init__(self):
+        self.enabled = False
+        self.log_interval = None
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._timers = {}
+        self._last_log = time.monotonic()
+
+    def count(self, name: str, n: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def timer(self, name: str):
+        """Context manager timing one phase, a shared no-op when disabled"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def add_time(self, name: str, seconds: float):
+        with self._lock:
+            timer = self._timers.get(name)
+            if timer is None:
+                self._timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'timers': {name: {'calls': calls, 'total': total, 'mean': total / calls, 'max': longest}
+                           for name, (calls, total, longest) in self._timers.items()},
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+
+    def maybe_log(self):
+        """Log a snapshot as one JSON line if log_interval seconds passed since the last one"""
+        if not self.enabled or self.log_interval is None:
+            return
+        now = time.monotonic()
+        if now - self._last_log >= self.log_interval:
+            self._last_log = now
+            logger.info("stats %s", json.dumps(self.snapshot(), sort_keys=True))
+
+
+stats = Stats()
+
+
+def enable(log_interval: float = None):
+    """Start collecting, with a structured log line at most every log_interval seconds if given"""
+    stats.log_interval = log_interval
+    stats.enabled = True
+
+
+def disable():
+    stats.enabled = False
+
+
+def snapshot() -> dict:
+    return stats.snapshot()
+
+
+def reset():
+    stats.reset()
+
+
+@contextmanager
+def profiled(path: str = None, top: int = 25):
+    """cProfile everything in the block, dump the stats to path if given and log the top functions"""
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        if path is not None:
+            profile.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(top)
+        logger.info("profile\n%s", out.getvalue())
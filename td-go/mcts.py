@@ -0,0 +1,411 @@
+# root-parallel monte carlo tree search player
+#
+#   bot = MCTSPlayer(Player.white, size=9, time_budget=2.0, processes=4)
+#   bot = MCTSPlayer(Player.white, size=9, evaluate=CharModelEvaluator())  # saved_model.h5 as priors
+#   bot = MCTSPlayer(Player.white, size=9, evaluate=CharModelEvaluator(cache=PredictionCache()))
+#   Game().play_game(human, bot, BOARDSIZE=9)
+#
+# Nodes live in a transposition table keyed on (zobrist hash, side to move,
+# passes in a row, ko point), so transpositions share statistics and the subtree
+# under the move actually played is reused on the next turn. With
+# processes > 1 every extra process searches its own tree from the same
+# root for the same time and the root visit counts are added up, the
+# playouts are pure Python so threads alone can't use more than one core.
+import multiprocessing as mp
+import os
+import random
+import threading
+import time
+import numpy as np
+from environment import BOARDSIZE, Position
+from fastboard import FastGoBoard, COLOR_TO_INT, neighbor_table
+from playGame import Game, ai_move_scores
+from players import Player
+from prediction_cache import symmetry_tables
+from scoring import compute_game_result
+
+PASS = Position(-1, -1)
+
+
+def _score_value(board: FastGoBoard, color: str) -> float:
+    """+1 if color wins the finished board, -1 if it loses"""
+    winner = compute_game_result(board).winner
+    return 1.0 if winner.color == color else -1.0
+
+
+def rollout_value(board: FastGoBoard, color: str, rng: random.Random, max_moves: int = None) -> float:
+    """Play random moves that don't fill own eyes until both sides pass, returns the result for color.
+
+    Moves are pushed and popped, the board is left as it was.
+    """
+    size = board.size
+    n = size * size
+    max_moves = max_moves if max_moves is not None else 2 * n
+    neighbors = neighbor_table(size)
+    stones = board.stones
+    pushed = 0
+    passes = 0
+    to_play = color
+    while passes < 2 and pushed < max_moves:
+        own = COLOR_TO_INT[to_play]
+        candidates = np.flatnonzero(board.legal_moves(to_play)[:-1]).tolist()
+        rng.shuffle(candidates)
+        for p in candidates:
+            if all(stones[q] == own for q in neighbors[p]):
+                continue  # own eye
+            if board.push(Position(p // size, p % size), to_play):  # superko can still say no
+                passes = 0
+                break
+        else:
+            board.push(PASS, to_play)
+            passes += 1
+        pushed += 1
+        to_play = 'w' if to_play == 'b' else 'b'
+    value = _score_value(board, color)
+    for _ in range(pushed):
+        board.pop()
+    return value
+
+
+def cached_priors(cache, board: FastGoBoard, color: str, priors) -> np.ndarray:
+    """priors() over size*size + 1 moves, through cache.lookup_position when cache isn't None.
+
+    Positions equal up to symmetry share one entry, the same way the tree
+    shares one node between transpositions; the value is left out of it so
+    every playout still gets a fresh rollout.
+    """
+    if cache is None:
+        return priors()
+    n = board.size * board.size
+
+    def evaluate(stones, k):
+        oriented = np.asarray(priors(), dtype=np.float64)
+        canonical = oriented.copy()
+        canonical[:n] = oriented[:n][symmetry_tables(board.size)[1][k]]
+        return canonical, None
+
+    return cache.lookup_position(board.stones, board.size, color, evaluate)[0]
+
+
+class RolloutEvaluator:
+    """Uniform priors over the legal moves and one random rollout as the value"""
+
+    def __init__(self, seed: int = None):
+        self._local = threading.local()
+        self._seed = seed
+
+    def _rng(self) -> random.Random:
+        rng = getattr(self._local, 'rng', None)
+        if rng is None:
+            # thread ids repeat across forked search processes, the pid keeps their rollouts apart
+            seed = None if self._seed is None else self._seed + threading.get_ident() + os.getpid()
+            rng = self._local.rng = random.Random(seed)
+        return rng
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def __call__(self, board: FastGoBoard, color: str, history):
+        return None, rollout_value(board, color, self._rng())
+
+
+class MovePriorEvaluator(RolloutEvaluator):
+    """move_model.MovePredictor probabilities as priors, random rollouts for the value.
+
+    cache is an optional prediction_cache.PredictionCache for the priors, one per evaluator.
+    """
+
+    def __init__(self, predictor, seed: int = None, cache=None):
+        super().__init__(seed)
+        self.predictor = predictor
+        self.cache = cache
+        self._lock = threading.Lock()  # the predictor keeps the LSTM state of one history
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._lock = threading.Lock()
+
+    def __call__(self, board: FastGoBoard, color: str, history):
+        def priors():
+            with self._lock:
+                return self.predictor.probabilities(history).copy()
+
+        return cached_priors(self.cache, board, color, priors), rollout_value(board, color, self._rng())
+
+
+class CharModelEvaluator(RolloutEvaluator):
+    """The character model in saved_model.h5 as priors, random rollouts for the value.
+
+    playGame.ai_move_scores gives a log probability for every point as the
+    reply to the last move, softmaxed here over the points; pass gets the
+    share of one uniform move, the model has no score for it. decoder
+    None loads playGame's own in each process on first use. cache is an
+    optional prediction_cache.PredictionCache for the priors, one per evaluator.
+    """
+
+    def __init__(self, seed: int = None, temperature: float = 1.0, decoder=None, cache=None):
+        super().__init__(seed)
+        self.temperature = temperature
+        self.decoder = decoder
+        self.cache = cache
+
+    def _priors(self, size: int, color: str, history) -> np.ndarray:
+        n = size * size
+        prev_move = history[-1] if history else PASS
+        scores = ai_move_scores(Game().input_to_move(prev_move, color), size, self.decoder)
+        if not np.isfinite(scores).any():
+            return np.full(n + 1, 1.0 / (n + 1))  # none of the board's letters are in the vocabulary
+        priors = np.exp((scores - scores.max()) / self.temperature)
+        return np.append(priors / priors.sum(), 1.0 / (n + 1))
+
+    def __call__(self, board: FastGoBoard, color: str, history):
+        priors = cached_priors(self.cache, board, color, lambda: self._priors(board.size, color, history))
+        return priors, rollout_value(board, color, self._rng())
+
+
+class _Node:
+    """Statistics of every legal move out of one position, from the point of view of the side to move"""
+    __slots__ = ('moves', 'priors', 'visits', 'values', 'total')
+
+    def __init__(self, moves: np.ndarray, priors: np.ndarray):
+        self.moves = moves  # flat indices, size*size is pass
+        self.priors = priors
+        self.visits = np.zeros(len(moves))
+        self.values = np.zeros(len(moves))
+        self.total = 0
+
+
+class MCTSPlayer:
+    """PUCT search with virtual loss, usable as a player in Game.play_game.
+
+    processes searches run in parallel, this one and processes - 1 worker
+    processes started on the first move, each with its own tree kept
+    between moves; the move played is the one with the most root visits
+    summed over all of them, max_playouts is shared out between them.
+    processes=None runs one search per core.
+
+    Within a process, threads searchers share one tree under a lock and
+    only hold it while walking down and backing up, with evaluation
+    outside it. That only pays off for an evaluate that releases the GIL,
+    like a model call; with the default pure Python rollouts keep
+    threads at 1. Every move in flight gets virtual_loss extra losing
+    visits so concurrent searchers spread over different lines. The search
+    stops after time_budget seconds or max_playouts playouts.
+
+    evaluate(board, color, history) returns (priors or None, value), the
+    priors over size*size + 1 moves and the value in [-1, 1] for color.
+    """
+
+    def __init__(self, player: Player = Player.white, size: int = BOARDSIZE, time_budget: float = 1.0,
+                 threads: int = 1, evaluate=None, c_puct: float = 1.5, virtual_loss: int = 3,
+                 max_playouts: int = None, max_nodes: int = 1000000, processes: int = 1):
+        self.player = player
+        self.color = player.color
+        self.name = f"MCTS {player.name}"
+        self.is_human = False
+        self.size = size
+        self.time_budget = time_budget
+        self.threads = threads
+        self.processes = processes or os.cpu_count() or 1
+        self.evaluate = evaluate or RolloutEvaluator()
+        self.c_puct = c_puct
+        self.virtual_loss = virtual_loss
+        self.max_playouts = max_playouts
+        self.max_nodes = max_nodes
+        self.table = {}  # (hash, color to move, passes, ko point) -> _Node
+        self._lock = threading.Lock()
+        self._workers = []  # (process, connection) of the other root searches
+        self.playouts = 0
+        self.last_playouts = 0
+
+    def _board(self, history):
+        """Board after history with superko on, the color to move and the passes in a row at the end"""
+        board = FastGoBoard(self.size, superko=True)
+        color = self.color if len(history) % 2 == 0 else ('w' if self.color == 'b' else 'b')
+        passes = 0
+        for move in history:
+            if move.x == -1 and move.y == -1:
+                passes += 1
+            else:
+                board.place_stone(move, color)
+                passes = 0
+            color = 'w' if color == 'b' else 'b'
+        return board, color, passes
+
+    def _expand(self, board: FastGoBoard, color: str, history):
+        legal = board.legal_moves(color).copy()
+        legal[-1] = True
+        moves = np.flatnonzero(legal)
+        priors, value = self.evaluate(board, color, history)
+        if priors is None:
+            priors = np.full(len(moves), 1.0 / len(moves))
+        else:
+            priors = np.asarray(priors, dtype=np.float64)[moves]
+            total = priors.sum()
+            priors = priors / total if total > 0 else np.full(len(moves), 1.0 / len(moves))
+        return _Node(moves, priors), value
+
+    def _select(self, node: _Node) -> int:
+        visits = node.visits
+        q = node.values / np.maximum(visits, 1)
+        u = self.c_puct * node.priors * np.sqrt(node.total + 1) / (1 + visits)
+        return int(np.argmax(q + u))
+
+    def _playout(self, board: FastGoBoard, color: str, passes: int, history):
+        size = self.size
+        n = size * size
+        path = []  # (node, edge) from the root down
+        pushed = 0
+        refused = False
+        history = list(history)
+        with self._lock:
+            while True:
+                node = self.table.get((board.hash, color, passes, board.ko_point))
+                if node is None or passes == 2:
+                    break
+                edge = self._select(node)
+                p = int(node.moves[edge])
+                move = PASS if p == n else Position(p // size, p % size)
+                node.visits[edge] += self.virtual_loss
+                node.values[edge] -= self.virtual_loss
+                node.total += self.virtual_loss
+                path.append((node, edge))
+                if not board.push(move, color):
+                    # superko depends on the path here, so the edge only loses this playout
+                    refused = True
+                    break
+                pushed += 1
+                history.append(move)
+                passes = passes + 1 if p == n else 0
+                color = 'w' if color == 'b' else 'b'
+
+        if refused:
+            value = 1.0  # for the side that would have moved next, so a loss for the one that tried
+            child = None
+        elif passes == 2:
+            value = _score_value(board, color)
+            child = None
+        else:
+            child, value = self._expand(board, color, history)
+
+        with self._lock:
+            if child is not None:
+                self.table.setdefault((board.hash, color, passes, board.ko_point), child)
+            for node, edge in reversed(path):
+                value = -value  # the parent moved for the other side
+                node.visits[edge] += 1 - self.virtual_loss
+                node.values[edge] += value + self.virtual_loss
+                node.total += 1 - self.virtual_loss
+            self.playouts += 1
+        for _ in range(pushed):
+            board.pop()
+
+    def _search(self, history, deadline: float, playouts: list, max_playouts: int = None):
+        board, color, passes = self._board(history)
+        while time.perf_counter() < deadline:
+            with self._lock:
+                if max_playouts is not None and playouts[0] >= max_playouts:
+                    return
+                playouts[0] += 1
+            self._playout(board, color, passes, history)
+
+    def search(self, history, max_playouts: int = None):
+        """Search this process's tree from the position after history, returns the root's
+        (moves, visits)"""
+        if len(self.table) > self.max_nodes:
+            self.table.clear()
+        board, color, passes = self._board(history)
+        root_key = (board.hash, color, passes, board.ko_point)
+        if root_key not in self.table:
+            self.table[root_key], _ = self._expand(board, color, history)
+        start = self.playouts
+        deadline = time.perf_counter() + self.time_budget
+        playouts = [0]
+        workers = [threading.Thread(target=self._search, args=(history, deadline, playouts, max_playouts),
+                                    daemon=True)
+                   for _ in range(self.threads - 1)]
+        for worker in workers:
+            worker.start()
+        self._search(history, deadline, playouts, max_playouts)
+        for worker in workers:
+            worker.join()
+        self.last_playouts = self.playouts - start
+        root = self.table[root_key]
+        return root.moves, root.visits.copy()
+
+    def _start_workers(self):
+        options = dict(player=self.player, size=self.size, time_budget=self.time_budget, threads=self.threads,
+                       evaluate=self.evaluate, c_puct=self.c_puct, virtual_loss=self.virtual_loss,
+                       max_nodes=self.max_nodes)
+        for _ in range(self.processes - 1):
+            connection, child = mp.Pipe()
+            process = mp.Process(target=_root_worker, args=(child, options), daemon=True)
+            process.start()
+            self._workers.append((process, connection))
+
+    def select_move(self, history, boardsize: int = None) -> Position:
+        """Search from the position after history (Positions, passes as (-1, -1)) and return the most visited move.
+
+        A boardsize other than size switches the player to that size, dropping its tree.
+        """
+        if boardsize is not None and boardsize != self.size:
+            self.close()
+            self.table.clear()
+            self.size = boardsize
+        if self.processes > 1 and not self._workers:
+            self._start_workers()
+        share = None if self.max_playouts is None else -(-self.max_playouts // self.processes)
+        for _, connection in self._workers:
+            connection.send((list(history), share))
+        moves, visits = self.search(history, share)
+        roots = [(moves, visits)]
+        for _, connection in self._workers:
+            worker_moves, worker_visits, worker_playouts = connection.recv()
+            roots.append((worker_moves, worker_visits))
+            self.last_playouts += worker_playouts
+        # added up by move, the roots needn't list the same moves
+        moves, index = np.unique(np.concatenate([m for m, _ in roots]), return_inverse=True)
+        visits = np.zeros(len(moves))
+        np.add.at(visits, index, np.concatenate([v for _, v in roots]))
+        board, color, _ = self._board(history)
+        for p in moves[np.argsort(-visits, kind='stable')].tolist():
+            move = PASS if p == self.size * self.size else Position(p // self.size, p % self.size)
+            if board.push(move, color):  # superko can refuse a move the tree kept
+                return move
+        return PASS
+
+    def close(self):
+        """Stop the worker processes, a later select_move starts new ones"""
+        for process, connection in self._workers:
+            connection.send(None)
+            process.join()
+        self._workers = []
+
+
+def _root_worker(connection, options: dict):
+    """One extra root search for MCTSPlayer: search whatever position comes in, send back the root visits"""
+    player = MCTSPlayer(**options)
+    while True:
+        request = connection.recv()
+        if request is None:
+            return
+        history, max_playouts = request
+        moves, visits = player.search(history, max_playouts)
+        connection.send((moves, visits, player.last_playouts))
+
+
+if __name__ == "__main__":
+    human = Player(Player.black)
+    human.set_human_or_ai(True)
+    Game().play_game(human, MCTSPlayer(Player.white, size=9, time_budget=2.0), BOARDSIZE=9)
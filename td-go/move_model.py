@@ -0,0 +1,139 @@
+# move-level model: every move is one token (x * size + y, or size * size for a pass),
+# embedded instead of one-hot encoded, so predicting a move is one LSTM step
+# instead of NEXT_COORDINATES character predictions
+import numpy as np
+from decoding import LSTMBeamDecoder
+from environment import Position
+from game_store import GameStore
+
+MOVE_MODEL_FILE_NAME = 'move_model.h5'
+EMBEDDING_DIM = 64
+UNITS = 128
+MAX_GAME_LENGTH = 400
+BATCH_SIZE = 32
+
+
+def move_to_token(move: Position, size: int) -> int:
+    if move.x == -1 and move.y == -1:
+        return size * size
+    return move.x * size + move.y
+
+
+def token_to_move(token: int, size: int) -> Position:
+    if token == size * size:
+        return Position(-1, -1)
+    return Position(token // size, token % size)
+
+
+def build_model(size: int, embedding_dim: int = EMBEDDING_DIM, units: int = UNITS):
+    """Embedding -> LSTM -> LSTM -> softmax over size*size + 1 move tokens at every step"""
+    import tensorflow as tf
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import Dense, Embedding, LSTM
+    vocab_size = size * size + 1
+    model = Sequential()
+    model.add(tf.keras.Input(shape=(None,), dtype='int32'))
+    model.add(Embedding(vocab_size, embedding_dim))
+    model.add(LSTM(units, return_sequences=True, dropout=0.2, recurrent_dropout=0.2))
+    model.add(LSTM(units, return_sequences=True, dropout=0.2, recurrent_dropout=0.2))
+    model.add(Dense(vocab_size, activation='softmax'))
+    model.compile(loss='sparse_categorical_crossentropy', optimizer='adam', weighted_metrics=[])
+    return model
+
+
+def game_batches(store: GameStore, size: int, batch_size: int = BATCH_SIZE, max_length: int = MAX_GAME_LENGTH,
+                 seed: int = None):
+    """Endless (inputs, targets, weights) batches of whole games of one board size.
+
+    Inputs start with a pass token standing in for "game start" and are
+    the targets shifted by one, so the model is trained exactly the way
+    MovePredictor runs it: from the first move, one token at a time.
+    Games are right-padded with passes that get zero weight.
+    """
+    rng = np.random.default_rng(seed)
+    games = np.flatnonzero((store.games['size'] == size) & (np.diff(store.offsets) > store.games['setup']))
+    if len(games) == 0:
+        raise ValueError(f"No {size}x{size} games in {store.path}")
+    pass_token = size * size
+    while True:
+        chosen = rng.choice(games, size=batch_size)
+        sequences = []
+        for index in chosen.tolist():
+            record = store.game(index)
+            sequences.append(np.asarray(record.moves[record.setup:record.setup + max_length], dtype=np.int32))
+        length = max(len(sequence) for sequence in sequences)
+        targets = np.full((batch_size, length), pass_token, dtype=np.int32)
+        weights = np.zeros((batch_size, length), dtype=np.float32)
+        for row, sequence in enumerate(sequences):
+            targets[row, :len(sequence)] = sequence
+            weights[row, :len(sequence)] = 1.0
+        inputs = np.concatenate([np.full((batch_size, 1), pass_token, dtype=np.int32), targets[:, :-1]], axis=1)
+        yield inputs, targets, weights
+
+
+def train(store_path: str, size: int = 19, epochs: int = 10, steps_per_epoch: int = 200,
+          batch_size: int = BATCH_SIZE, model_path: str = MOVE_MODEL_FILE_NAME, seed: int = None):
+    """Train a move model on the games of one board size in a game_store and save it"""
+    import tensorflow as tf
+    store = GameStore(store_path)
+    dataset = tf.data.Dataset.from_generator(
+        lambda: game_batches(store, size, batch_size, seed=seed),
+        output_signature=(tf.TensorSpec((None, None), tf.int32),
+                          tf.TensorSpec((None, None), tf.int32),
+                          tf.TensorSpec((None, None), tf.float32)))
+    model = build_model(size)
+    model.fit(dataset.prefetch(tf.data.AUTOTUNE), epochs=epochs, steps_per_epoch=steps_per_epoch, verbose=2)
+    model.save(model_path)
+    return model
+
+
+class MovePredictor:
+    """Next-move distribution for a game in progress, advancing the LSTM one token per new move.
+
+    The states for the last history seen are kept, so when the history
+    only grew since the previous call, only the new moves are fed in.
+    """
+
+    def __init__(self, model, size: int):
+        self.size = size
+        self.decoder = LSTMBeamDecoder(model)
+        if self.decoder.vocab_size != size * size + 1:
+            raise ValueError(f"Model predicts {self.decoder.vocab_size} tokens, a {size}x{size} board needs {size * size + 1}")
+        self._tokens = [size * size]  # the game-start pass
+        self._states = self.decoder.step(np.array(self._tokens), self.decoder.initial_states())
+
+    def probabilities(self, history) -> np.ndarray:
+        """size*size + 1 probabilities for the move after the Positions in history, pass last"""
+        tokens = [self.size * self.size] + [move_to_token(move, self.size) for move in history]
+        if tokens[:len(self._tokens)] != self._tokens:  # a new game or a different one
+            self._tokens = tokens[:1]
+            self._states = self.decoder.step(np.array(self._tokens), self.decoder.initial_states())
+        for token in tokens[len(self._tokens):]:
+            self._states = self.decoder.step(np.array([token]), self._states)
+        self._tokens = tokens
+        return self.decoder.probabilities(self._states)[0]
+
+    def best_move(self, history) -> Position:
+        return token_to_move(int(np.argmax(self.probabilities(history))), self.size)
+
+
+def load_predictor(size: int, model_path: str = MOVE_MODEL_FILE_NAME) -> MovePredictor:
+    import tensorflow as tf
+    return MovePredictor(tf.keras.models.load_model(model_path), size)
+
+
+if __name__ == "__main__":
+    import sys
+    store = GameStore(sys.argv[1])
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 9
+    model = build_model(size, embedding_dim=16, units=32)
+    batches = game_batches(store, size, batch_size=8, seed=0)
+    for _ in range(3):
+        model.train_on_batch(*next(batches))
+    # the predictor's one step per move has to agree with the model run over the whole sequence
+    record = store.game(0)
+    history = [token_to_move(int(token), size) for token in record.moves[record.setup:record.setup + 20]]
+    predictor = MovePredictor(model, size)
+    expected = model.predict(np.array([[size * size] + [move_to_token(m, size) for m in history]]), verbose=0)[0]
+    gap = max(np.abs(predictor.probabilities(history[:i]) - expected[i]).max() for i in range(len(history) + 1))
+    print(f"max probability gap over {len(history) + 1} moves: {gap:.2e}")
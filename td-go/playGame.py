@@ -1,35 +1,107 @@
 from environment import *
 from players import Player
 from scoring import compute_game_result
+from fastboard import FastGoBoard
+from instrumentation import profiled, stats
+from training_data import save_vocabulary
 from collections import namedtuple
+import json
+import os
+import time
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras.models import Sequential, Model, load_model
-from tensorflow.keras.layers import Dense
-from tensorflow.keras.layers import LSTM
 import logging
-tf.get_logger().setLevel(logging.ERROR)
 WINDOW_LENGTH = 40
 WINDOW_STEP = 3
 BEAM_SIZE = 8
 NEXT_COORDINATES = 4
 MAX_LENGTH = 50
 INPUT_FILE_NAME = 'GoExampleData.txt'
-load_model = tf.keras.models.load_model('saved_model.h5')
+MODEL_FILE_NAME = 'saved_model.h5'
+VOCAB_FILE_NAME = 'vocab.json'  # characters in the model's index order, saved next to the model
+TFLITE_FILE_NAME = 'saved_model.tflite'  # written by tflite_backend.py
+INFERENCE_BACKEND = os.environ.get('GO_INFERENCE_BACKEND', 'numpy')  # 'numpy' or 'tflite'
 
-file = open(INPUT_FILE_NAME, 'r', encoding='utf-8')
-text = file.read()
-file.close()
-text = text.replace('\n', ' ')
-text = text.replace('  ', ' ')
-text = text.replace('B', ' ')
-text = text.replace('W', ' ')
-text = text.replace(';', ' ')
+logger = logging.getLogger(__name__)
 
+_model = None
+_vocabulary = None
+_decoder = None
 
 
-class Game:
+def get_model():
+    """Load the model the first time a prediction needs it, TensorFlow is imported here too"""
+    global _model
+    if _model is None:
+        import tensorflow as tf
+        tf.get_logger().setLevel(logging.ERROR)
+        _model = tf.keras.models.load_model(MODEL_FILE_NAME)
+    return _model
+
+
+def get_decoder():
+    """Incremental-state beam search over the loaded model, see decoding.LSTMBeamDecoder,
+    or over its TFLite export when INFERENCE_BACKEND is 'tflite'"""
+    global _decoder
+    if _decoder is None:
+        if INFERENCE_BACKEND == 'tflite':
+            from tflite_backend import TFLiteDecoder
+            _decoder = TFLiteDecoder(TFLITE_FILE_NAME, BEAM_SIZE)
+        elif INFERENCE_BACKEND == 'numpy':
+            from decoding import LSTMBeamDecoder
+            _decoder = LSTMBeamDecoder(get_model(), BEAM_SIZE)
+        else:
+            raise ValueError(f"Unknown inference backend {INFERENCE_BACKEND!r}, use 'numpy' or 'tflite'")
+    return _decoder
+
+
+def read_corpus(file_name=INPUT_FILE_NAME):
+    """Game records with the same clean-up the notebooks apply before training"""
+    file = open(file_name, 'r', encoding='utf-8')
+    text = file.read()
+    file.close()
+    text = text.replace('\n', ' ')
+    text = text.replace('  ', ' ')
+    text = text.replace('B', ' ')
+    text = text.replace('W', ' ')
+    text = text.replace(';', ' ')
+    return text
+
 
+def build_vocabulary(corpus_file=INPUT_FILE_NAME, vocab_file=VOCAB_FILE_NAME):
+    """Derive the vocabulary from the corpus once and save it next to the model, sorted like
+    training_data.tokenize_corpus and the notebooks save it"""
+    return save_vocabulary(read_corpus(corpus_file), vocab_file)
+
+
+def get_vocabulary():
+    """Returns (char_to_index, index_to_char), built from the corpus only if no vocab file exists yet"""
+    global _vocabulary
+    if _vocabulary is None:
+        if os.path.exists(VOCAB_FILE_NAME):
+            with open(VOCAB_FILE_NAME, 'r', encoding='utf-8') as file:
+                unique_chars = json.load(file)
+        else:
+            unique_chars = build_vocabulary()
+        char_to_index = dict((ch, index) for index, ch
+                             in enumerate(unique_chars))
+        index_to_char = dict((index, ch) for index, ch
+                             in enumerate(unique_chars))
+        _vocabulary = (char_to_index, index_to_char)
+    return _vocabulary
+
+
+
+class Game:
+    # decoder is anything with score_pairs(prompt, lead, first, second, max_lead), e.g. a
+    # batching.InferenceBatcher shared by many games, None uses the module's own decoder
+    # cache is an optional prediction_cache.PredictionCache in front of the model
+    # move_model is an optional move_model.MovePredictor, which predicts from the whole
+    # game's move history with one model step per move instead of the character model
+    def __init__(self, decoder=None, cache=None, move_model=None):
+        self.decoder = decoder
+        self.cache = cache
+        self.move_model = move_model
+        self.history = []
 
     #Takes a Position and color of player and returns a string to give to the neural net
     def input_to_move(self, move, color):
@@ -38,15 +110,14 @@ class Game:
         move_string = color.upper() + "[" + chr(row) + chr(col) + "]" 
         return move_string
 
-    #Takes the string outputted by the neural net, parses it, and returns a Position
+    #Takes the string outputted by the neural net, parses it, and returns a Position, a pass if nothing parses
     def move_to_input(self, move) -> Position:
-        for index, char in enumerate(move):
+        for index, char in enumerate(move[:-2]):
             row = move[index+1]
             col = move[index+2]
             if char == "[" and row.islower() and row.isalpha() and col.islower() and col.isalpha():
                 return Position(ord(row)-97, ord(col)-97)
-
-                
+        return Position(-1, -1)
 
     def get_formatted_move(self, boardsize: int) -> Position:
         Position = namedtuple("Position", ["x", "y"])
@@ -64,29 +135,82 @@ class Game:
             except ValueError:
                 print("Invalid format. Please enter as row,col (e.g., 3,4).")
 
-    def get_bot_move(self, prev_move, player) -> Position:
-        translate_prev_move = self.input_to_move(prev_move, player.color)
-        move = ai_predict(translate_prev_move)
-        return self.move_to_input(move)
+    # legal is a board's legal_moves mask (size*size points then pass), the move returned
+    # is always one of its moves, so the board never rejects it
+    def get_bot_move(self, prev_move, player, boardsize: int = BOARDSIZE, legal=None) -> Position:
+        if hasattr(player, 'select_move'):  # a searching player like mcts.MCTSPlayer
+            return player.select_move(self.history, boardsize)
+        if legal is None:
+            legal = np.ones(boardsize * boardsize + 1, dtype=bool)
+        if self.move_model is not None:
+            stats.count('model_calls')
+            return best_legal_move(self.move_model.probabilities(self.history), legal, boardsize)
+        return best_legal_move(self.move_scores(prev_move, player.color, boardsize), legal, boardsize)
+
+    def move_scores(self, prev_move, color, boardsize: int = BOARDSIZE) -> np.ndarray:
+        """Model log probability of every point x * boardsize + y as the reply to prev_move"""
+        if self.cache is None:
+            return ai_move_scores(self.input_to_move(prev_move, color), boardsize, self.decoder)
+        return self.cache.lookup_move_scores(
+            prev_move, boardsize,
+            lambda move: ai_move_scores(self.input_to_move(move, color), boardsize, self.decoder))
+
 
 
+    # profile=True runs this one game under cProfile and logs the hottest functions,
+    # a file name also dumps the stats there for pstats/snakeviz
+    # max_moves ends and scores the game early, the character model never passes on its own
+    # resign_margin makes a bot resign once the running score has it behind by that many points,
+    # checked from halfway through a board's worth of moves
+    # board_class is the engine, GoBoard or fastboard.FastGoBoard, which has the same API
+    # and also enforces ko; None picks GoBoard, or FastGoBoard with superko when a searching
+    # player like mcts.MCTSPlayer takes part, since it searches under those rules
+    def play_game(self, player1, player2, BOARDSIZE=19, profile=None, max_moves=None, resign_margin=None,
+                  board_class=None):
+        if profile:
+            with profiled(None if profile is True else profile):
+                return self._play_game(player1, player2, BOARDSIZE, max_moves, resign_margin, board_class)
+        return self._play_game(player1, player2, BOARDSIZE, max_moves, resign_margin, board_class)
 
-    def play_game(self, player1, player2, BOARDSIZE=19):
-        board = GoBoard(BOARDSIZE)
+    def _play_game(self, player1, player2, BOARDSIZE, max_moves=None, resign_margin=None, board_class=None):
+        searching = hasattr(player1, 'select_move') or hasattr(player2, 'select_move')
+        if searching:
+            if board_class is not None and not issubclass(board_class, FastGoBoard):
+                raise ValueError("A searching player needs board_class=FastGoBoard, "
+                                 "GoBoard doesn't play by the rules it searches under")
+            board = (board_class or FastGoBoard)(BOARDSIZE, superko=True)
+        else:
+            board = (board_class or GoBoard)(BOARDSIZE)
+        if resign_margin is not None and hasattr(board, 'track_territory'):
+            board.track_territory()  # the resign check reads the score after every move
         current_player = player1
         game_over = False
         valid_move = False
         pass_flag = 0
         prev_move = Position(-1, -1)
+        self.history = []
 
         while not game_over | (pass_flag == 2):  # Game continues until two consecutive passes
+            if max_moves is not None and len(self.history) >= max_moves:
+                break
+            # territory-only counting hands a lone stone the whole empty board, so no resigning in the opening
+            if (resign_margin is not None and not current_player.is_human
+                    and len(self.history) >= BOARDSIZE * BOARDSIZE // 2):
+                leader = board.decisive(resign_margin)
+                if leader is not None and leader.color != current_player.color:
+                    stats.count('resignations')
+                    print(f"{current_player.name} resigns, {board.current_score()}")
+                    break
 
             while(not valid_move): # valid_move is True when a valid move is made
-                board.display()
+                with stats.timer('display'):
+                    board.display()
                 print(f"{current_player.name}'s turn ({current_player.color})")
                 if current_player.is_human:
-                    move = self.get_formatted_move(BOARDSIZE)
-                    valid_move = board.place_stone(move, current_player.color)
+                    with stats.timer('human_input'):
+                        move = self.get_formatted_move(BOARDSIZE)
+                    with stats.timer('place_stone'):
+                        valid_move = board.place_stone(move, current_player.color)
                     if move.x == -1 and move.y == -1:
                         print(f"{current_player.name} passes.")
                         valid_move = True
@@ -94,16 +218,32 @@ class Game:
                     else:
                         pass_flag = 0
                 else:
-                    move = self.get_bot_move(prev_move, current_player)
-                    valid_move = board.place_stone(move, current_player.color)
+                    with stats.timer('bot_move'):
+                        # only the model-ranked moves need the mask, a searching player works out its own;
+                        # on a FastGoBoard this is its incremental mask, GoBoard scans every empty point
+                        legal = (None if hasattr(current_player, 'select_move')
+                                 else board.legal_moves(current_player.color))
+                        move = self.get_bot_move(prev_move, current_player, BOARDSIZE, legal)
+                    with stats.timer('place_stone'):
+                        valid_move = board.place_stone(move, current_player.color)
+                    if not valid_move and not (move.x == -1 and move.y == -1):
+                        # a player that ignores the mask, passing beats asking it the same question forever
+                        stats.count('illegal_retries')
+                        print(f"{current_player.name} tried an illegal move {move}.")
+                        move = Position(-1, -1)
                     if move.x == -1 and move.y == -1:
                         print(f"{current_player.name} passes.")
                         valid_move = True
                         pass_flag += 1
                     else:
                         pass_flag = 0
+                if not valid_move:
+                    stats.count('illegal_retries')
 
             prev_move = move
+            self.history.append(move)
+            stats.count('passes' if move.x == -1 and move.y == -1 else 'moves')
+            stats.maybe_log()
 
             if current_player == player1:
                 current_player = player2
@@ -111,52 +251,71 @@ class Game:
                 current_player = player1
             valid_move = False
         result = compute_game_result(board)
+        stats.count('games')
         print("Game over!")
         print(result)
 
-def ai_predict(input_string):
+def best_legal_move(scores, legal, boardsize: int) -> Position:
+    """Highest scoring legal point, or a pass when it scores higher still or nothing is legal.
+
+    scores has one entry per point and optionally a last one for pass.
+    """
+    n = boardsize * boardsize
+    scores = np.asarray(scores, dtype=np.float64)
+    masked = np.where(legal[:n], scores[:n], -np.inf)
+    best = int(np.argmax(masked))
+    if masked[best] == -np.inf or (len(scores) > n and legal[n] and scores[n] > masked[best]):
+        return Position(-1, -1)
+    return Position(best // boardsize, best % boardsize)
+
+
+def ai_move_scores(input_string, boardsize: int, decoder=None) -> np.ndarray:
+    """Log probability of every point x * boardsize + y coming next after input_string.
+
+    Instead of beam decoding a few characters and parsing whatever comes
+    out, the model decodes up to the next '[' and then scores both
+    coordinate letters for every point in one batched step, so every call
+    ranks every point and the caller can mask out the illegal ones.
+    Points whose letters the model has never seen score -inf.
+    """
+    input_string = input_string.replace('W', ' ')
+    input_string = input_string.replace('B', ' ')
+    char_to_index, index_to_char = get_vocabulary()
+    decoder = decoder or get_decoder()
+    letters = [chr(97 + i) for i in range(boardsize)]
+    known = [i for i, letter in enumerate(letters) if letter in char_to_index]
+    tokens = [char_to_index[letter] for letter in letters if letter in char_to_index]
+    scores = np.full((boardsize, boardsize), -np.inf)
+    start = time.perf_counter()
+    if known and '[' in char_to_index:
+        prompt = [char_to_index[char] for char in input_string if char in char_to_index]  # a pass is '[``]'
+        scores[np.ix_(known, known)] = decoder.score_pairs(prompt, char_to_index['['], tokens, tokens,
+                                                           NEXT_COORDINATES)
+    elapsed = time.perf_counter() - start
+    logger.debug("ai_move_scores took %.2f ms", elapsed * 1000)
+    if stats.enabled:
+        stats.add_time('ai_predict', elapsed)
+        stats.count('model_calls')
+        stats.count('beams_evaluated', len(known) * len(known))
+    return scores.ravel()
+
+
+# free-running text continuation of input_string, the bot itself ranks points with ai_move_scores
+def ai_predict(input_string, decoder=None):
     input_string = input_string.replace('W', ' ')
     input_string = input_string.replace('B', ' ')
-    unique_chars = list(set(text))
-    char_to_index = dict((ch, index) for index, ch 
-                        in enumerate(unique_chars))
-    index_to_char = dict((index, ch) for index, ch 
-                        in enumerate(unique_chars))
-    encoding_width = len(char_to_index)
-    next_move = input_string
-    one_hots = []
-    for i, char in enumerate(next_move):
-        x = np.zeros(encoding_width)
-        x[char_to_index[char]] = 1
-        one_hots.append(x)
-    beams = [(np.log(1.0), next_move, one_hots)]
-    for i in range(NEXT_COORDINATES):
-        minibatch_list = []
-        # Create minibatch from one-hot encodings, and predict.
-        for triple in beams:
-            minibatch_list.append(triple[2])
-        minibatch = np.array(minibatch_list)
-        y_predict = load_model.predict(minibatch, verbose=0)
-        new_beams = []
-        for j, softmax_vec in enumerate(y_predict):
-            triple = beams[j]
-            # Create BEAM_SIZE new beams from each existing beam.
-            for k in range(BEAM_SIZE):
-                char_index = np.argmax(softmax_vec)
-                new_prob = triple[0] + np.log(
-                    softmax_vec[char_index])
-                new_letters = triple[1] + index_to_char[char_index]
-                x = np.zeros(encoding_width)
-                x[char_index] = 1
-                new_one_hots = triple[2].copy()
-                new_one_hots.append(x)
-                new_beams.append((new_prob, new_letters,
-                                new_one_hots))
-                softmax_vec[char_index] = 0
-        # Prune tree to only keep BEAM_SIZE most probable beams.
-        new_beams.sort(key=lambda tup: tup[0], reverse=True)
-        beams = new_beams[0:BEAM_SIZE]
-    output = str(beams[1])
+    char_to_index, index_to_char = get_vocabulary()
+    decoder = decoder or get_decoder()
+    start = time.perf_counter()
+    beams = decoder.decode([char_to_index[char] for char in input_string], NEXT_COORDINATES)
+    elapsed = time.perf_counter() - start
+    logger.debug("ai_predict took %.2f ms", elapsed * 1000)
+    if stats.enabled:
+        stats.add_time('ai_predict', elapsed)
+        stats.count('model_calls')
+        stats.count('beams_evaluated', len(beams) * NEXT_COORDINATES)
+    prob, indices = beams[1]
+    output = str((prob, ''.join(index_to_char[index] for index in indices)))
     return output
 
 if __name__ == "__main__":
@@ -0,0 +1,188 @@
+# memoizes model outputs per position up to rotation and reflection of the board
+import os
+import pickle
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+from environment import Position
+
+_symmetry_tables = {}
+
+
+def transform_point(x: int, y: int, k: int, size: int):
+    """Apply dihedral symmetry k (0-3 rotations, 4-7 rotations of the mirror image)"""
+    if k >= 4:
+        y = size - 1 - y
+    for _ in range(k % 4):
+        x, y = y, size - 1 - x
+    return x, y
+
+
+def symmetry_tables(size: int):
+    """(forward, inverse) permutations of flat indices x * size + y for all 8 symmetries"""
+    tables = _symmetry_tables.get(size)
+    if tables is None:
+        forward = np.empty((8, size * size), dtype=np.int64)
+        for k in range(8):
+            for x in range(size):
+                for y in range(size):
+                    tx, ty = transform_point(x, y, k, size)
+                    forward[k, x * size + y] = tx * size + ty
+        inverse = np.argsort(forward, axis=1)
+        tables = (forward, inverse)
+        _symmetry_tables[size] = tables
+    return tables
+
+
+def canonical_position(stones: np.ndarray, size: int):
+    """Smallest of the 8 symmetric copies of a flat stone array, returns (copy, k) with copy[forward[k][p]] == stones[p]"""
+    _, inverse = symmetry_tables(size)
+    copies = stones[inverse]
+    keys = [copy.tobytes() for copy in copies]
+    k = min(range(8), key=keys.__getitem__)
+    return copies[k], k
+
+
+def canonical_point(position: Position, size: int):
+    """Smallest symmetric image of a single move, returns (canonical Position, k); passes map to themselves"""
+    if position.x == -1 and position.y == -1:
+        return position, 0
+    images = [transform_point(position.x, position.y, k, size) for k in range(8)]
+    k = min(range(8), key=images.__getitem__)
+    return Position(*images[k]), k
+
+
+def _nbytes(value) -> int:
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, tuple):
+        return sys.getsizeof(value) + sum(_nbytes(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class PredictionCache:
+    """Thread-safe LRU of model outputs keyed on symmetry-canonical inputs.
+
+    Misses are evaluated on the canonical form of the input, so every
+    member of a symmetry class shares one entry, and outputs are mapped
+    back through the inverse symmetry on the way out. Entries are evicted
+    least recently used first once there are more than max_entries or
+    they take more than max_bytes. With a path the cache is loaded from
+    it on creation and written back by save().
+    """
+
+    def __init__(self, max_entries: int = 100000, max_bytes: int = 256 * 1024 * 1024, path: str = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.path = path
+        self._entries = OrderedDict()  # key -> (value, size in bytes)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = sys.getsizeof(key) + _nbytes(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self.bytes > self.max_bytes):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def lookup_move_scores(self, move: Position, size: int, score):
+        """Cached score(move) -> per-point scores (x * size + y, optionally then pass) for a reply to move.
+
+        The scores come back in the caller's orientation, so a legality mask
+        for the caller's board can be applied to them directly. The key
+        leaves out whose reply it is: the character model never sees the
+        colors, ai_move_scores strips them from the prompt.
+        """
+        canonical, k = canonical_point(move, size)
+        key = ('move_scores', size, canonical)
+        scores = self.get(key)
+        if scores is None:
+            scores = score(canonical)
+            self.put(key, scores)
+        forward, _ = symmetry_tables(size)
+        n = size * size
+        oriented = np.asarray(scores).copy()
+        oriented[:n] = np.asarray(scores)[:n][forward[k]]
+        return oriented
+
+    def lookup_position(self, stones: np.ndarray, size: int, color: str, evaluate):
+        """Cached evaluate(stones, k) -> (policy, value) for a board evaluator.
+
+        evaluate gets the canonical stones and the symmetry k that maps the
+        caller's points onto them, so an evaluator that looks at more than
+        the stones, like a move history, can map its inputs or outputs the
+        same way. policy has one entry per point (x * size + y), optionally
+        followed by pass, and comes back in the caller's orientation.
+        """
+        canonical, k = canonical_position(np.asarray(stones).ravel(), size)
+        key = ('position', size, color, canonical.tobytes())
+        result = self.get(key)
+        if result is None:
+            result = evaluate(canonical.reshape(np.shape(stones)), k)
+            self.put(key, result)
+        policy, value = result
+        forward, _ = symmetry_tables(size)
+        n = size * size
+        oriented = np.asarray(policy).copy()
+        oriented[:n] = np.asarray(policy)[:n][forward[k]]
+        return oriented, value
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+        }
+
+    def save(self, path: str = None):
+        path = path or self.path
+        with self._lock:
+            items = [(key, value) for key, (value, _) in self._entries.items()]
+        with open(path, 'wb') as file:
+            pickle.dump(items, file)
+
+    def load(self, path: str = None):
+        """Add the entries saved at path, oldest first so the LRU order survives"""
+        with open(path or self.path, 'rb') as file:
+            items = pickle.load(file)
+        for key, value in items:
+            self.put(key, value)
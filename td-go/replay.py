@@ -0,0 +1,230 @@
+# fixed-capacity replay store for self-play positions, one structured NumPy row per afterstate
+#
+#   buffer = ReplayBuffer(100000, 9, prioritized=True, path='replay_dir')
+#   buffer.add_game(trajectory, reward, actions, values=agent.value(trajectory))
+#   batch, indices, weights = buffer.sample(64)
+#   buffer.update_priorities(indices, np.abs(batch['reward'] - agent.value(batch['stones'])))
+#
+# replay_dir/records.npy     capacity rows of record_dtype(size), memory-mapped
+# replay_dir/priorities.npy  sum tree over the rows' priorities, float64, memory-mapped
+# replay_dir/meta.json       head, count and the settings the buffer was created with
+import json
+import os
+import numpy as np
+
+META_FILE_NAME = 'meta.json'
+RECORDS_FILE_NAME = 'records.npy'
+PRIORITIES_FILE_NAME = 'priorities.npy'
+
+
+def record_dtype(size: int) -> np.dtype:
+    return np.dtype([
+        ('hash', np.uint64),  # zobrist hash of the afterstate, 0 when unknown
+        ('stones', np.int8, (size * size,)),  # flat afterstate, 0 empty 1 black 2 white
+        ('action', np.int16),  # x * size + y of the move played, size * size for a pass
+        ('color', np.int8),  # 1 black, 2 white
+        ('reward', np.float32),  # game result from black's side, 1.0 black won
+        ('value', np.float32),  # estimate of the reward when the row was stored
+        ('done', np.bool_),  # last afterstate of its game
+    ])
+
+
+class ReplayBuffer:
+    """Ring buffer of afterstates in one structured array, oldest rows overwritten first.
+
+    Appends write one row in place, sampling is a fancy index of the array.
+    With prioritized, rows are drawn in proportion to priority ** alpha
+    through a sum tree stored as a flat array: both drawing a batch and
+    updating its priorities walk the tree level by level for the whole
+    batch at once. With a path the arrays are memory-mapped files in that
+    directory, so save only has to flush them and open maps them back.
+    """
+
+    def __init__(self, capacity: int, size: int, prioritized: bool = False, alpha: float = 0.6,
+                 path: str = None, _arrays=None):
+        self.capacity = capacity
+        self.size = size
+        self.prioritized = prioritized
+        self.alpha = alpha
+        self.path = path
+        self.head = 0  # next row to write
+        self.count = 0
+        self.max_priority = 1.0  # new rows get the largest priority seen, so they're sampled soon
+        self._leaves = 1 << max(capacity - 1, 0).bit_length()
+        if _arrays is not None:
+            self.records, self._tree = _arrays
+        elif path is None:
+            self.records = np.zeros(capacity, dtype=record_dtype(size))
+            self._tree = np.zeros(2 * self._leaves, dtype=np.float64)
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.records = np.lib.format.open_memmap(os.path.join(path, RECORDS_FILE_NAME), mode='w+',
+                                                     dtype=record_dtype(size), shape=(capacity,))
+            self._tree = np.lib.format.open_memmap(os.path.join(path, PRIORITIES_FILE_NAME), mode='w+',
+                                                   dtype=np.float64, shape=(2 * self._leaves,))
+            self.save()
+
+    def __len__(self):
+        return self.count
+
+    def append(self, stones, action: int, color: int, reward: float = 0.0, value: float = 0.0,
+               hash: int = 0, done: bool = False) -> int:
+        """Store one afterstate, returns its row"""
+        row = self.head
+        record = self.records[row]
+        record['hash'] = hash
+        record['stones'] = stones
+        record['action'] = action
+        record['color'] = color
+        record['reward'] = reward
+        record['value'] = value
+        record['done'] = done
+        self._set_priorities(np.array([row]), self.max_priority)
+        self.head = (row + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        return row
+
+    def add_game(self, trajectory: np.ndarray, reward: float, actions=None, values=None, hashes=None,
+                 first_color: int = 1) -> np.ndarray:
+        """Store a whole game of afterstates, as Agent.end_episode returns them, in one slice
+        assignment per field, returns their rows"""
+        moves = len(trajectory)
+        if moves == 0:
+            return np.zeros(0, dtype=np.int64)
+        rows = (self.head + np.arange(moves)) % self.capacity
+        if moves > self.capacity:  # only the end of the game fits
+            rows = rows[-self.capacity:]
+        keep = slice(moves - len(rows), moves)
+        records = self.records
+        records['stones'][rows] = np.asarray(trajectory)[keep]
+        records['hash'][rows] = 0 if hashes is None else np.asarray(hashes, dtype=np.uint64)[keep]
+        records['action'][rows] = -1 if actions is None else np.asarray(actions)[keep]
+        records['color'][rows] = np.where(np.arange(moves)[keep] % 2 == 0, first_color, 3 - first_color)
+        records['reward'][rows] = reward
+        records['value'][rows] = 0.0 if values is None else np.asarray(values)[keep]
+        records['done'][rows] = False
+        records['done'][rows[-1]] = True
+        self._set_priorities(rows, self.max_priority)
+        self.head = int(rows[-1] + 1) % self.capacity
+        self.count = min(self.count + moves, self.capacity)
+        return rows
+
+    def sample(self, batch_size: int, rng: np.random.Generator = None, beta: float = 0.4):
+        """(records, rows, importance weights) for batch_size rows drawn with replacement.
+
+        Uniform unless the buffer is prioritized, then the weights correct
+        for the skew, (count * P(row)) ** -beta scaled so the largest is 1;
+        uniform draws have weights of 1.
+        """
+        if not self.count:
+            raise ValueError("Cannot sample from an empty replay buffer")
+        rng = rng or np.random.default_rng()
+        if not self.prioritized:
+            rows = rng.integers(0, self.count, size=batch_size)  # rows fill from 0, so these are all written
+            return self.records[rows], rows, np.ones(batch_size, dtype=np.float32)
+        tree = self._tree
+        total = tree[1]
+        # one draw from each of batch_size equal slices of the total, then down the tree
+        targets = (np.arange(batch_size) + rng.random(batch_size)) * (total / batch_size)
+        nodes = np.ones(batch_size, dtype=np.int64)
+        while nodes[0] < self._leaves:
+            left = tree[2 * nodes]
+            right = targets >= left
+            targets -= np.where(right, left, 0.0)
+            nodes = 2 * nodes + right
+        rows = np.minimum(nodes - self._leaves, self.count - 1)  # float round-off can step past the end
+        probabilities = tree[rows + self._leaves] / total
+        weights = (self.count * probabilities) ** -beta
+        return self.records[rows], rows, (weights / weights.max()).astype(np.float32)
+
+    def update_priorities(self, rows: np.ndarray, errors: np.ndarray, epsilon: float = 1e-3):
+        """Set the priority of rows from their new TD errors"""
+        priorities = np.abs(np.asarray(errors, dtype=np.float64)) + epsilon
+        self.max_priority = max(self.max_priority, float(priorities.max(initial=0.0)))
+        self._set_priorities(np.asarray(rows), priorities)
+
+    def _set_priorities(self, rows: np.ndarray, priorities):
+        if not self.prioritized:
+            return
+        tree = self._tree
+        nodes = rows + self._leaves
+        tree[nodes] = np.asarray(priorities, dtype=np.float64) ** self.alpha
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:  # every parent is recomputed from its children, so repeats are harmless
+            tree[nodes] = tree[2 * nodes] + tree[2 * nodes + 1]
+            if nodes[0] == 1:
+                break
+            nodes = np.unique(nodes // 2)
+
+    def save(self, path: str = None):
+        """Write the buffer to path, for a memory-mapped buffer without a new path this
+        only flushes the maps and rewrites meta.json"""
+        path = path or self.path
+        if path is None:
+            raise ValueError("No path to save the replay buffer to")
+        os.makedirs(path, exist_ok=True)
+        if path == self.path and isinstance(self.records, np.memmap):
+            self.records.flush()
+            self._tree.flush()
+        else:
+            np.save(os.path.join(path, RECORDS_FILE_NAME), self.records)
+            np.save(os.path.join(path, PRIORITIES_FILE_NAME), self._tree)
+        meta = {
+            'capacity': self.capacity,
+            'size': self.size,
+            'prioritized': self.prioritized,
+            'alpha': self.alpha,
+            'head': self.head,
+            'count': self.count,
+            'max_priority': self.max_priority,
+        }
+        with open(os.path.join(path, META_FILE_NAME), 'w', encoding='utf-8') as file:
+            json.dump(meta, file)
+
+    @classmethod
+    def open(cls, path: str, mode: str = 'r+') -> "ReplayBuffer":
+        """Map a saved buffer back without reading it, mode 'r' for a read-only view"""
+        with open(os.path.join(path, META_FILE_NAME), 'r', encoding='utf-8') as file:
+            meta = json.load(file)
+        arrays = (np.load(os.path.join(path, RECORDS_FILE_NAME), mmap_mode=mode),
+                  np.load(os.path.join(path, PRIORITIES_FILE_NAME), mmap_mode=mode))
+        buffer = cls(meta['capacity'], meta['size'], meta['prioritized'], meta['alpha'], path, _arrays=arrays)
+        buffer.head = meta['head']
+        buffer.count = meta['count']
+        buffer.max_priority = meta['max_priority']
+        return buffer
+
+
+if __name__ == "__main__":
+    import tempfile
+    import time
+    size = 9
+    rng = np.random.default_rng(0)
+    games = [rng.integers(0, 3, size=(int(rng.integers(40, 120)), size * size)).astype(np.int8) for _ in range(50)]
+    with tempfile.TemporaryDirectory() as directory:
+        buffer = ReplayBuffer(2000, size, prioritized=True, path=directory)
+        start = time.perf_counter()
+        for game in games:
+            buffer.add_game(game, float(rng.random() < 0.5), actions=rng.integers(0, size * size + 1, len(game)))
+        elapsed = time.perf_counter() - start
+        print(f"{sum(map(len, games))} afterstates added in {elapsed * 1000:.1f} ms, {len(buffer)} kept, "
+              f"{buffer.records.nbytes / len(buffer.records):.0f} bytes per row")
+        # the newest row of every kept game is marked done and holds the game's last afterstate
+        assert np.array_equal(buffer.records['stones'][(buffer.head - 1) % buffer.capacity], games[-1][-1])
+        rows = np.arange(0, 2000, 2)
+        buffer.update_priorities(rows, np.full(len(rows), 10.0))
+        batch, sampled, weights = buffer.sample(4096, rng)
+        print(f"prioritized: {np.mean(sampled % 2 == 0):.0%} of draws from the rows with 10x the error")
+        start = time.perf_counter()
+        for _ in range(100):
+            buffer.sample(256, rng)
+        print(f"sample(256): {(time.perf_counter() - start) * 10:.3f} ms")
+        buffer.save()
+        reopened = ReplayBuffer.open(directory)
+        assert isinstance(reopened.records, np.memmap)
+        assert (reopened.head, reopened.count) == (buffer.head, buffer.count)
+        assert np.array_equal(reopened.records, buffer.records)
+        assert np.allclose(reopened._tree, buffer._tree)
+        reopened.append(games[0][0], 0, 1, 1.0)
+        print(f"reopened {len(reopened)} rows, head {reopened.head}")
+        del buffer, reopened
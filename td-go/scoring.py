@@ -3,7 +3,11 @@
 #         self.territory = None  # Territory will be calculated at the end of the game
 
 from collections import namedtuple
+import numpy as np
 from players import Player, Point
+from instrumentation import stats
+
+KOMI = 6.5
 
 class Territory(object):
     def __init__(self, territory_map):
@@ -45,22 +49,26 @@ def _collect_region(start_pos, board, visited=None):
         visited = {}
     if start_pos in visited:
         return [], set()
-    all_points = [start_pos]
+    all_points = []
     all_boarders = set()
     visited[start_pos] = True
     here = board.get(start_pos)
     deltas = [(-1, 0), (1, 0), (0, -1), (0, 1)]
-    for delta_r, delta_c in deltas:
-        next_p = Point(row = start_pos.row + delta_r, col = start_pos.col + delta_c)
-        if not board.is_on_grid(next_p):
-            continue
-        neighbor = board.get(next_p)
-        if neighbor == here:
-            points, boarder = _collect_region(next_p, board, visited)
-            all_points += points
-            all_boarders |= boarder
-        else:
-            all_boarders.add(neighbor)
+    stack = [start_pos]  # explicit stack so big empty regions can't hit the recursion limit
+    while stack:
+        pos = stack.pop()
+        all_points.append(pos)
+        for delta_r, delta_c in deltas:
+            next_p = Point(row = pos.row + delta_r, col = pos.col + delta_c)
+            if not board.is_on_grid(next_p):
+                continue
+            neighbor = board.get(next_p)
+            if neighbor == here:
+                if next_p not in visited:
+                    visited[next_p] = True
+                    stack.append(next_p)
+            else:
+                all_boarders.add(neighbor)
     return all_points, all_boarders
     
 def evaluate_territory(board):
@@ -85,11 +93,115 @@ def evaluate_territory(board):
                     status[point] = fill_with
     return Territory(status)
 
-        
+_on_grid_masks = {}
+
+def _on_grid_mask(board):
+    """Which points 1..num_rows x 1..num_cols the board reports as on the grid, cached per board type and size"""
+    key = (type(board), board.num_rows, board.num_cols)
+    mask = _on_grid_masks.get(key)
+    if mask is None:
+        mask = np.array([[board.is_on_grid(Point(row=r, col=c))
+                          for c in range(1, board.num_cols + 1)]
+                         for r in range(1, board.num_rows + 1)])
+        _on_grid_masks[key] = mask
+    return mask
+
+def _stone_array(board):
+    """0 empty, 1 black, 2 white for every point, row-1 and col-1 indexed like board.get"""
+    stones = getattr(board, 'stones', None)
+    if stones is not None:
+        return stones.reshape(board.num_rows, board.num_cols)
+    values = np.zeros((board.num_rows, board.num_cols), dtype=np.int8)
+    for r in range(1, board.num_rows + 1):
+        for c in range(1, board.num_cols + 1):
+            stone = board.get(Point(row=r, col=c))
+            if stone is not None:
+                values[r - 1, c - 1] = stone.value
+    return values
+
+_SHIFTS = [
+    # (dst, src) slices pairing every point with its neighbor in one direction
+    ((slice(None), slice(1, None), slice(None)), (slice(None), slice(None, -1), slice(None))),
+    ((slice(None), slice(None, -1), slice(None)), (slice(None), slice(1, None), slice(None))),
+    ((slice(None), slice(None), slice(1, None)), (slice(None), slice(None), slice(None, -1))),
+    ((slice(None), slice(None), slice(None, -1)), (slice(None), slice(None), slice(1, None))),
+]
+
+def _territory_counts(stones, on_grid):
+    """Vectorized evaluate_territory for a stack of same-size boards.
+
+    Labels the empty regions of every board at once by min-label propagation,
+    then works out which colors border each region. Points off the grid are
+    scored like _collect_region does: they only see their on-grid neighbors.
+    Returns black and white territory per board.
+    """
+    num_boards, rows, cols = stones.shape
+    on_grid = np.broadcast_to(on_grid, stones.shape)
+    values = np.where(on_grid, stones, 0)
+    empty = on_grid & (values == 0)
+    off_grid = ~on_grid
+
+    # every empty point starts with its own flat index as label
+    big = values.size
+    labels = np.where(empty, np.arange(big).reshape(stones.shape), big)
+    while True:
+        new_labels = labels.copy()
+        for dst, src in _SHIFTS:
+            joined = empty[dst] & empty[src]
+            new_labels[dst] = np.where(joined, np.minimum(new_labels[dst], labels[src]), new_labels[dst])
+        flat = new_labels.ravel()
+        inside = flat < big
+        flat[inside] = flat[flat[inside]]  # pointer jumping to the label's own label
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+
+    # colors bordering each region, indexed by label
+    has_b = np.zeros(big + 1, dtype=bool)
+    has_w = np.zeros(big + 1, dtype=bool)
+    for dst, src in _SHIFTS:
+        seen_from = empty[dst] & on_grid[src]
+        has_b[labels[dst][seen_from & (values[src] == Player.black.value)]] = True
+        has_w[labels[dst][seen_from & (values[src] == Player.white.value)]] = True
+    has_b[big] = has_w[big] = False
+
+    point_b = empty & has_b[labels]
+    point_w = empty & has_w[labels]
+    # off-grid points pick up what their on-grid neighbors see
+    off_b = np.zeros(stones.shape, dtype=bool)
+    off_w = np.zeros(stones.shape, dtype=bool)
+    for dst, src in _SHIFTS:
+        seen_from = off_grid[dst] & on_grid[src]
+        off_b[dst] |= seen_from & ((values[src] == Player.black.value) | point_b[src])
+        off_w[dst] |= seen_from & ((values[src] == Player.white.value) | point_w[src])
+    point_b |= off_grid & off_b
+    point_w |= off_grid & off_w
+
+    territory_b = (point_b & ~point_w).sum(axis=(1, 2))
+    territory_w = (point_w & ~point_b).sum(axis=(1, 2))
+    return territory_b, territory_w
+
+def compute_game_results(boards):
+    """Score a batch of finished boards, returns each margin b - (w + komi) as an array"""
+    stats.count('boards_scored', len(boards))
+    margins = np.zeros(len(boards))
+    by_shape = {}
+    for i, board in enumerate(boards):
+        by_shape.setdefault((type(board), board.num_rows, board.num_cols), []).append(i)
+    for indices in by_shape.values():
+        stones = np.stack([_stone_array(boards[i]) for i in indices])
+        with stats.timer('scoring'):
+            territory_b, territory_w = _territory_counts(stones, _on_grid_mask(boards[indices[0]]))
+        margins[indices] = territory_b - territory_w - KOMI
+    return margins
+
 def compute_game_result(board):
-    territory = evaluate_territory(board)
+    # same totals as evaluate_territory: stones are stored as colors there and never counted
+    with stats.timer('scoring'):
+        territory_b, territory_w = _territory_counts(_stone_array(board)[np.newaxis], _on_grid_mask(board))
+    stats.count('boards_scored')
     return GameResults(
-        b=territory.num_b_stones + territory.num_b_territory,
-        w=territory.num_w_stones + territory.num_w_territory,
-        komi=6.5
-    )
\ No newline at end of file
+        b=int(territory_b[0]),
+        w=int(territory_w[0]),
+        komi=KOMI
+    )
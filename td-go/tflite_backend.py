@@ -0,0 +1,230 @@
+# TFLite export and interpreter backend for the character LSTM
+#
+#   python tflite_backend.py --quantize dynamic   # writes saved_model.tflite, checks parity, times it
+#   GO_INFERENCE_BACKEND=tflite python playGame.py
+#
+# The flatbuffer holds one decoding step, (one-hot token, states) -> (softmax,
+# new states), the same step LSTMBeamDecoder takes, so the bot keeps carrying
+# states forward instead of re-running whole sequences.
+import argparse
+import time
+import numpy as np
+from decoding import LSTMBeamDecoder
+
+TFLITE_FILE_NAME = 'saved_model.tflite'
+BATCH_SIZES = (1, 8, 32)  # one interpreter allocated per size, bigger batches are split
+QUANTIZATIONS = (None, 'dynamic', 'int8')
+
+
+def _step_function(reference: LSTMBeamDecoder):
+    """tf.function for one step of the reference decoder's weights, any batch size"""
+    import tensorflow as tf
+    vocab_size = reference.vocab_size
+    signature = [tf.TensorSpec((None, vocab_size), tf.float32, name='token')]
+    for i, (_, recurrent, _, _, _) in enumerate(reference.lstms):
+        units = recurrent.shape[0]
+        signature += [tf.TensorSpec((None, units), tf.float32, name=f'h{i}'),
+                      tf.TensorSpec((None, units), tf.float32, name=f'c{i}')]
+    activations = {np.tanh: tf.tanh}
+    layers = [(tf.constant(kernel), tf.constant(recurrent), tf.constant(bias),
+               activations.get(activation, tf.sigmoid), activations.get(recurrent_activation, tf.sigmoid))
+              for kernel, recurrent, bias, activation, recurrent_activation in reference.lstms]
+    dense_kernel = tf.constant(reference.dense_kernel)
+    dense_bias = tf.constant(reference.dense_bias)
+
+    @tf.function(input_signature=signature)
+    def step(token, *states):
+        x = token
+        outputs = []
+        for i, (kernel, recurrent, bias, activation, recurrent_activation) in enumerate(layers):
+            h, c = states[2 * i], states[2 * i + 1]
+            z = tf.matmul(x, kernel) + tf.matmul(h, recurrent) + bias
+            gate_i, gate_f, gate_c, gate_o = tf.split(z, 4, axis=1)
+            c = recurrent_activation(gate_f) * c + recurrent_activation(gate_i) * activation(gate_c)
+            h = recurrent_activation(gate_o) * activation(c)
+            outputs += [h, c]
+            x = h
+        return [tf.nn.softmax(tf.matmul(x, dense_kernel) + dense_bias)] + outputs
+
+    return step
+
+
+def _representative_steps(reference: LSTMBeamDecoder, batch: int = 8, samples: int = 200, seed: int = 0):
+    """Calibration inputs for int8: states reached by feeding random tokens through the reference"""
+    rng = np.random.default_rng(seed)
+    identity = np.eye(reference.vocab_size, dtype=np.float32)
+    states = reference.initial_states(batch)
+    for _ in range(samples):
+        tokens = rng.integers(0, reference.vocab_size, size=batch)
+        yield [identity[tokens]] + [array for pair in states for array in pair]
+        states = reference.step(tokens, states)
+
+
+def export_tflite(model, path: str = TFLITE_FILE_NAME, quantization: str = None) -> int:
+    """Convert the model's decoding step to a TFLite flatbuffer, returns its size in bytes.
+
+    quantization is None (float32), 'dynamic' (int8 weights, float
+    activations) or 'int8' (weights and activations, calibrated on random
+    token sequences; inputs and outputs stay float).
+    """
+    import tensorflow as tf
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"quantization must be one of {QUANTIZATIONS}, not {quantization!r}")
+    reference = LSTMBeamDecoder(model)
+    step = _step_function(reference)
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([step.get_concrete_function()], step)
+    if quantization is not None:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'int8':
+        converter.representative_dataset = lambda: _representative_steps(reference)
+    flatbuffer = converter.convert()
+    with open(path, 'wb') as file:
+        file.write(flatbuffer)
+    return len(flatbuffer)
+
+
+def _interpreter_class():
+    """The standalone LiteRT interpreter when it's installed, TensorFlow's otherwise"""
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class _Slot:
+    """One interpreter with its tensors allocated for a fixed batch and its input arrays preallocated"""
+
+    def __init__(self, interpreter, batch: int):
+        self.interpreter = interpreter
+        self.batch = batch
+        inputs = {detail['name'].split(':')[0].split('_')[-1]: detail for detail in interpreter.get_input_details()}
+        for detail in inputs.values():
+            interpreter.resize_tensor_input(detail['index'], [batch, detail['shape'][1]])
+        interpreter.allocate_tensors()
+        self.num_layers = (len(inputs) - 1) // 2
+        self.inputs = [inputs['token']] + [inputs[f'{kind}{i}'] for i in range(self.num_layers) for kind in 'hc']
+        self.buffers = [np.zeros((batch, detail['shape'][1]), dtype=np.float32) for detail in self.inputs]
+        # outputs come out as Identity, Identity_1, ... in the order the step function returns them
+        self.outputs = sorted(interpreter.get_output_details(), key=lambda d: int(d['name'].partition('_')[2] or 0))
+
+    def invoke(self):
+        interpreter = self.interpreter
+        for detail, buffer in zip(self.inputs, self.buffers):
+            interpreter.set_tensor(detail['index'], buffer)
+        interpreter.invoke()
+        return [interpreter.get_tensor(detail['index']) for detail in self.outputs]
+
+
+class TFLiteDecoder(LSTMBeamDecoder):
+    """LSTMBeamDecoder whose steps run in a TFLite interpreter.
+
+    There is one interpreter per entry of batch_sizes, allocated once, and
+    a step goes to the smallest one that fits: prompt steps run one row,
+    beam steps beam_size rows, bigger batches are padded or split. The
+    softmax comes out of the same call, so it rides along as one more
+    (probabilities, probabilities) pair at the end of the states: beam
+    reordering then carries it with the LSTM states it belongs to.
+    """
+
+    def __init__(self, path: str = TFLITE_FILE_NAME, beam_size: int = 8, num_threads: int = None,
+                 batch_sizes=BATCH_SIZES):
+        self.beam_size = beam_size
+        interpreter_class = _interpreter_class()
+        self.slots = [_Slot(interpreter_class(model_path=path, num_threads=num_threads), batch)
+                      for batch in sorted(set(batch_sizes) | {beam_size})]
+        first = self.slots[0]
+        self.num_layers = first.num_layers
+        self.vocab_size = first.buffers[0].shape[1]
+        self.units = [buffer.shape[1] for buffer in first.buffers[1::2]]
+        self._identity = np.eye(self.vocab_size, dtype=np.float32)
+        self.moves = 0
+        self.total_time = 0.0
+        self.last_latency = 0.0
+
+    def initial_states(self, batch: int = 1):
+        states = [(np.zeros((batch, units), dtype=np.float32), np.zeros((batch, units), dtype=np.float32))
+                  for units in self.units]
+        uniform = np.full((batch, self.vocab_size), 1.0 / self.vocab_size, dtype=np.float32)
+        return states + [(uniform, uniform)]
+
+    def step(self, tokens: np.ndarray, states):
+        tokens = np.asarray(tokens)
+        rows = len(tokens)
+        slot = next((slot for slot in self.slots if slot.batch >= rows), self.slots[-1])
+        inputs = [np.asarray(array) for pair in states[:self.num_layers] for array in pair]
+        parts = [[] for _ in range(1 + 2 * self.num_layers)]
+        for start in range(0, rows, slot.batch):
+            count = min(slot.batch, rows - start)
+            slot.buffers[0][:count] = self._identity[tokens[start:start + count]]
+            slot.buffers[0][count:] = 0
+            for buffer, array in zip(slot.buffers[1:], inputs):
+                buffer[:count] = array[start:start + count]
+            for part, output in zip(parts, slot.invoke()):
+                part.append(output[:count].copy())
+        arrays = [np.concatenate(part) if len(part) > 1 else part[0] for part in parts]
+        probabilities = arrays[0]
+        return ([(arrays[1 + 2 * i], arrays[2 + 2 * i]) for i in range(self.num_layers)]
+                + [(probabilities, probabilities)])
+
+    def probabilities(self, states) -> np.ndarray:
+        return states[-1][0]
+
+
+def check_parity(model, decoder: LSTMBeamDecoder, prompts, steps: int = 4):
+    """Compare decoder's next-token distribution with Keras predict on the same sequences,
+    print the largest gap, top-1 and top-beam agreement and per-step latencies"""
+    vocab_size = model.output_shape[-1]
+    identity = np.eye(vocab_size, dtype=np.float32)
+    reference = LSTMBeamDecoder(model, decoder.beam_size)
+    max_gap = 0.0
+    same_top = 0
+    same_beam = 0
+    keras_time = 0.0
+    decoder_time = 0.0
+    reference_time = 0.0
+    steps_taken = 0
+    for prompt in prompts:
+        start = time.perf_counter()
+        expected = model.predict(identity[np.asarray(prompt)][np.newaxis], verbose=0)[0]
+        keras_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        states = decoder.initial_states()
+        for token in prompt:
+            states = decoder.step(np.array([token]), states)
+        actual = decoder.probabilities(states)[0]
+        decoder_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        states = reference.initial_states()
+        for token in prompt:
+            states = reference.step(np.array([token]), states)
+        reference_time += time.perf_counter() - start
+
+        steps_taken += len(prompt)
+        max_gap = max(max_gap, float(np.abs(actual - expected).max()))
+        same_top += int(np.argmax(actual) == np.argmax(expected))
+        same_beam += int(np.array_equal(decoder.decode(prompt, steps)[0][1], reference.decode(prompt, steps)[0][1]))
+    print(f"max probability gap {max_gap:.2e}, same top token {same_top}/{len(prompts)}, "
+          f"same best beam {same_beam}/{len(prompts)}")
+    print(f"per step: keras predict {keras_time / steps_taken * 1000:.3f} ms (whole sequence per call), "
+          f"numpy {reference_time / steps_taken * 1000:.3f} ms, tflite {decoder_time / steps_taken * 1000:.3f} ms")
+    print(f"per move: numpy {reference.mean_latency * 1000:.2f} ms, tflite {decoder.mean_latency * 1000:.2f} ms")
+    return max_gap, same_top / len(prompts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the model to TFLite and compare it with Keras")
+    parser.add_argument('--out', default=TFLITE_FILE_NAME)
+    parser.add_argument('--quantize', choices=['none', 'dynamic', 'int8'], default='none')
+    args = parser.parse_args()
+    from playGame import get_model
+    model = get_model()
+    quantization = None if args.quantize == 'none' else args.quantize
+    size = export_tflite(model, args.out, quantization)
+    print(f"wrote {args.out}, {size / 1024:.0f} KiB, quantization {args.quantize}")
+    rng = np.random.default_rng(0)
+    prompts = [rng.integers(0, model.output_shape[-1], size=rng.integers(5, 40)) for _ in range(20)]
+    check_parity(model, TFLiteDecoder(args.out), prompts)
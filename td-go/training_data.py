@@ -0,0 +1,195 @@
+# streams (window, next character) training examples for the character LSTM from a
+# memory-mapped token file, so memory use does not grow with the corpus
+#
+#   tokenize_corpus('Jan1940-Dec1944.txt', 'Jan1940-Dec1944.tokens')
+#   train = make_dataset('Jan1940-Dec1944.tokens', subset='training')
+#   val = make_dataset('Jan1940-Dec1944.tokens', subset='validation', shuffle=False)
+#   model.fit(train, validation_data=val, epochs=EPOCHS)
+import json
+import math
+import os
+import re
+import numpy as np
+
+WINDOW_LENGTH = 40
+WINDOW_STEP = 3
+BATCH_SIZE = 256
+VOCAB_FILE_NAME = 'vocab.json'
+TOKEN_DTYPE = np.uint16
+CHUNK_SIZE = 1 << 22  # characters read per chunk while tokenizing
+SHUFFLE_BLOCK = 256  # consecutive windows shuffled as one block
+SHUFFLE_BUFFER = 1 << 16  # window numbers shuffled together at a time
+
+_space_run = re.compile(' {2,}')
+
+
+def _collapse_spaces(match):
+    # text.replace('  ', ' ') turns a run of n spaces into ceil(n / 2)
+    return ' ' * ((len(match.group()) + 1) // 2)
+
+
+def clean_chunks(corpus_file: str, chunk_size: int = CHUNK_SIZE):
+    """Yield the corpus with the notebooks' clean-up applied, chunk by chunk.
+
+    Matches the str.replace chain in the notebooks exactly: trailing spaces
+    are held back so a run of spaces split across chunks collapses the same
+    way it would in one string.
+    """
+    carry = ''
+    with open(corpus_file, 'r', encoding='utf-8') as file:
+        while True:
+            chunk = file.read(chunk_size)
+            text = carry + chunk.replace('\n', ' ')
+            if chunk:
+                stripped = text.rstrip(' ')
+                carry = text[len(stripped):]
+                text = stripped
+            text = _space_run.sub(_collapse_spaces, text)
+            yield text.replace('B', ' ').replace('W', ' ').replace(';', ' ')
+            if not chunk:
+                return
+
+
+def save_vocabulary(chars, vocab_file: str = VOCAB_FILE_NAME) -> list:
+    """Write the distinct chars to vocab_file sorted, the index order every writer and the notebooks use"""
+    unique_chars = sorted(set(chars))
+    with open(vocab_file, 'w', encoding='utf-8') as file:
+        json.dump(unique_chars, file)
+    return unique_chars
+
+
+def tokenize_corpus(corpus_file: str, tokens_file: str, vocab_file: str = VOCAB_FILE_NAME):
+    """Write the corpus as a flat TOKEN_DTYPE file of vocabulary indices, returns the token count.
+
+    Uses the vocabulary in vocab_file if there is one, otherwise collects
+    it from the corpus first and saves it there.
+    """
+    if os.path.exists(vocab_file):
+        with open(vocab_file, 'r', encoding='utf-8') as file:
+            unique_chars = json.load(file)
+    else:
+        chars = set()
+        for text in clean_chunks(corpus_file):
+            chars.update(text)
+        unique_chars = save_vocabulary(chars, vocab_file)
+    codepoints = np.array([ord(char) for char in unique_chars])
+    order = np.argsort(codepoints)
+    sorted_codepoints = codepoints[order]
+
+    count = 0
+    with open(tokens_file, 'wb') as out:
+        for text in clean_chunks(corpus_file):
+            if not text:
+                continue
+            chunk = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+            positions = np.searchsorted(sorted_codepoints, chunk).clip(0, len(codepoints) - 1)
+            unknown = sorted_codepoints[positions] != chunk
+            if unknown.any():
+                raise ValueError(f"Character {chr(chunk[unknown][0])!r} is not in {vocab_file}")
+            order[positions].astype(TOKEN_DTYPE).tofile(out)
+            count += len(chunk)
+    return count
+
+
+def load_tokens(tokens_file: str) -> np.ndarray:
+    return np.memmap(tokens_file, dtype=TOKEN_DTYPE, mode='r')
+
+
+def _window_range(num_tokens: int, window_length: int, window_step: int, validation_split: float, subset: str):
+    """First and last window number of a subset, validation is the tail like Keras validation_split"""
+    num_windows = len(range(0, num_tokens - window_length, window_step))
+    num_train = num_windows - int(num_windows * validation_split)
+    if subset == 'training':
+        return 0, num_train
+    if subset == 'validation':
+        return num_train, num_windows
+    raise ValueError(f"subset must be 'training' or 'validation', not {subset!r}")
+
+
+def _window_order(count: int, rng: np.random.Generator, shuffle: bool, block: int, buffer: int):
+    """Yield range(count) in arrays of at most buffer window numbers, in order or shuffled.
+
+    Shuffling puts blocks of block consecutive windows in random order, then
+    shuffles buffer windows' worth of blocks together, so memory is one
+    entry per block plus the buffer however long the corpus is.
+    """
+    if not shuffle:
+        for start in range(0, count, buffer):
+            yield np.arange(start, min(start + buffer, count), dtype=np.int64)
+        return
+    blocks = rng.permutation(-(-count // block))
+    per_buffer = max(buffer // block, 1)
+    offsets = np.arange(block, dtype=np.int64)
+    for start in range(0, len(blocks), per_buffer):
+        numbers = (blocks[start:start + per_buffer, np.newaxis] * block + offsets).ravel()
+        numbers = numbers[numbers < count]  # only the last block can run past the end
+        rng.shuffle(numbers)
+        yield numbers
+
+
+def window_batches(tokens, vocab_size: int, batch_size: int = BATCH_SIZE, window_length: int = WINDOW_LENGTH,
+                   window_step: int = WINDOW_STEP, validation_split: float = 0.05, subset: str = 'training',
+                   shuffle: bool = True, one_hot_labels: bool = True, seed: int = None, epochs: int = 1,
+                   shuffle_block: int = SHUFFLE_BLOCK, shuffle_buffer: int = SHUFFLE_BUFFER):
+    """Yield (X, y) batches: X one-hot float32 (batch, window_length, vocab_size), y one-hot or int labels.
+
+    Windows and targets are the same as the notebooks build (every
+    window_step characters, target is the next one). Every epoch reshuffles
+    with _window_order, only shuffle_buffer window numbers and one batch of
+    windows are held in memory.
+    """
+    first, last = _window_range(len(tokens), window_length, window_step, validation_split, subset)
+    count = last - first
+    rng = np.random.default_rng(seed)
+    identity = np.eye(vocab_size, dtype=np.float32)
+    offsets = np.arange(window_length + 1)
+
+    def batch(numbers):
+        starts = (first + np.sort(numbers)) * window_step  # sorted so the memmap reads go forward
+        windows = np.asarray(tokens[starts[:, np.newaxis] + offsets], dtype=np.int64)
+        x = identity[windows[:, :-1]]
+        y = identity[windows[:, -1]] if one_hot_labels else windows[:, -1]
+        return x, y
+
+    for _ in range(epochs):
+        pending = np.zeros(0, dtype=np.int64)  # the end of one buffer goes into the next one's first batch
+        for numbers in _window_order(count, rng, shuffle, shuffle_block, shuffle_buffer):
+            numbers = np.concatenate([pending, numbers])
+            full = len(numbers) - len(numbers) % batch_size
+            for batch_start in range(0, full, batch_size):
+                yield batch(numbers[batch_start:batch_start + batch_size])
+            pending = numbers[full:]
+        if len(pending):
+            yield batch(pending)
+
+
+def steps_per_epoch(tokens, batch_size: int = BATCH_SIZE, window_length: int = WINDOW_LENGTH,
+                    window_step: int = WINDOW_STEP, validation_split: float = 0.05, subset: str = 'training') -> int:
+    first, last = _window_range(len(tokens), window_length, window_step, validation_split, subset)
+    return math.ceil((last - first) / batch_size)
+
+
+def make_dataset(tokens_file: str, vocab_file: str = VOCAB_FILE_NAME, batch_size: int = BATCH_SIZE,
+                 window_length: int = WINDOW_LENGTH, window_step: int = WINDOW_STEP, validation_split: float = 0.05,
+                 subset: str = 'training', shuffle: bool = True, one_hot_labels: bool = True, seed: int = None):
+    """tf.data pipeline over window_batches that reshuffles every epoch and prefetches in the background.
+
+    Use loss='sparse_categorical_crossentropy' with one_hot_labels=False.
+    """
+    import tensorflow as tf
+    with open(vocab_file, 'r', encoding='utf-8') as file:
+        vocab_size = len(json.load(file))
+    rng = np.random.default_rng(seed)
+
+    def generator():
+        # re-entered by tf.data at the start of every epoch, each pass gets a new shuffle
+        tokens = load_tokens(tokens_file)
+        yield from window_batches(tokens, vocab_size, batch_size, window_length, window_step, validation_split,
+                                  subset, shuffle, one_hot_labels, seed=int(rng.integers(1 << 31)))
+
+    label_spec = (tf.TensorSpec((None, vocab_size), tf.float32) if one_hot_labels
+                  else tf.TensorSpec((None,), tf.int64))
+    dataset = tf.data.Dataset.from_generator(
+        generator,
+        output_signature=(tf.TensorSpec((None, window_length, vocab_size), tf.float32), label_spec))
+    return dataset.prefetch(tf.data.AUTOTUNE)
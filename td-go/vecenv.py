@@ -0,0 +1,91 @@
+# runs many go games in lockstep so a model can evaluate every position in one batch
+import numpy as np
+from environment import BOARDSIZE, Position
+from fastboard import FastGoBoard, BLACK, INT_TO_COLOR
+from scoring import compute_game_results
+
+
+class VecGoEnv:
+    """num_envs FastGoBoards whose stones share one (num_envs, size*size) array.
+
+    Actions are flat indices x * size + y, with size*size meaning pass, the
+    same layout as FastGoBoard.legal_moves. An illegal action counts as a
+    pass. A game ends after two passes in a row or max_moves moves, is
+    scored with the rest of the batch and starts over on the same row.
+    """
+
+    def __init__(self, num_envs: int, size: int = BOARDSIZE, max_moves: int = None, superko: bool = True):
+        self.num_envs = num_envs
+        self.size = size
+        self.num_points = size * size
+        self.max_moves = max_moves if max_moves is not None else 2 * self.num_points
+        self.superko = superko
+        self.stones = np.zeros((num_envs, self.num_points), dtype=np.int8)
+        self.to_play = np.full(num_envs, BLACK, dtype=np.int8)  # 1 black, 2 white
+        self.passes = np.zeros(num_envs, dtype=np.int32)
+        self.move_count = np.zeros(num_envs, dtype=np.int32)
+        self.boards = [None] * num_envs
+        self.margins = np.full(num_envs, np.nan)  # b - (w + komi) of each env's last finished game
+        self.games_played = 0
+
+    def _reset_env(self, i: int):
+        self.boards[i] = FastGoBoard(self.size, self.superko, buffer=self.stones[i])
+        self.to_play[i] = BLACK
+        self.passes[i] = 0
+        self.move_count[i] = 0
+
+    def reset(self) -> np.ndarray:
+        for i in range(self.num_envs):
+            self._reset_env(i)
+        return self.observations()
+
+    def observations(self) -> np.ndarray:
+        """Stones of every game as a (num_envs, size, size) array, 0 empty, 1 black, 2 white"""
+        return self.stones.reshape(self.num_envs, self.size, self.size).copy()
+
+    def legal_moves(self) -> np.ndarray:
+        """(num_envs, size*size + 1) legal-move masks for the side to move in each game"""
+        return np.stack([board.legal_moves(INT_TO_COLOR[color])
+                         for board, color in zip(self.boards, self.to_play.tolist())])
+
+    def step(self, actions):
+        """Play one move in every game, returns observations, rewards and done flags.
+
+        Rewards are 0 until a game ends, then +1 if black won and -1 if white
+        won. Finished games are reset, so their observation is the empty board.
+        """
+        size = self.size
+        for i, action in enumerate(np.asarray(actions).tolist()):
+            color = self.to_play[i]
+            if action != self.num_points and self.boards[i].place_stone(
+                    Position(action // size, action % size), INT_TO_COLOR[color]):
+                self.passes[i] = 0
+            else:
+                self.passes[i] += 1
+            self.to_play[i] = 3 - color
+            self.move_count[i] += 1
+
+        dones = (self.passes >= 2) | (self.move_count >= self.max_moves)
+        rewards = np.zeros(self.num_envs)
+        finished = np.flatnonzero(dones)
+        if len(finished):
+            margins = compute_game_results([self.boards[i] for i in finished])
+            self.margins[finished] = margins
+            rewards[finished] = np.sign(margins)
+            self.games_played += len(finished)
+            for i in finished:
+                self._reset_env(i)
+        return self.observations(), rewards, dones
+
+
+if __name__ == "__main__":
+    # random self-play on every board at once
+    env = VecGoEnv(64, size=9)
+    env.reset()
+    rng = np.random.default_rng(0)
+    while env.games_played < 256:
+        legal = env.legal_moves().astype(float)
+        legal[:, -1] = 0.01  # rarely pass while there are other moves
+        actions = [rng.choice(len(p), p=p / p.sum()) for p in legal]
+        env.step(actions)
+    print("games:", env.games_played, "black win rate:", np.mean(env.margins > 0))